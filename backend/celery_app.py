@@ -0,0 +1,42 @@
+# backend/celery_app.py
+
+import logging
+
+import redis
+from celery import Celery
+
+from . import config
+from .services.redis_service import redis_client
+
+logger = logging.getLogger(__name__)
+
+# --- Training Job Queue (TRAINING_QUEUE=celery) ---
+# Training jobs are queued in Redis (REDIS_URL) and run by separate worker
+# processes instead of the API server's threadpool, so they scale independently:
+#   celery -A backend.celery_app worker --concurrency=N --prefetch-multiplier=1
+# Job status is tracked in job_store (which must be Redis-backed for the API to
+# see it), so task results aren't stored. Workers write trained models to their
+# SCRATCH_DIR, which the upload endpoint must be able to read.
+celery_app = Celery("training", broker=config.REDIS_URL)
+celery_app.conf.update(
+    task_ignore_result=True,
+    # Acknowledge only once a job finishes, so a crashed worker's job is redelivered
+    task_acks_late=True,
+    worker_prefetch_multiplier=1, # Long tasks: don't reserve jobs other workers could start
+)
+
+@celery_app.task(name="training.run_training_job")
+def run_training_job_task(job_id: str, **job_args):
+    """Runs a training job in a worker process. Not retried: payment is verified again on each run."""
+    # Imported here so the API process can import this module without the ML stack
+    from .services.training_pipeline import run_training_job
+    logger.info("Worker picked up training job %s", job_id)
+    run_training_job(job_id, **job_args)
+
+def queue_depth() -> int | None:
+    """Jobs in the broker queue that no worker has picked up yet. None if Redis can't be reached."""
+    try:
+        return redis_client.llen(celery_app.conf.task_default_queue)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read training queue depth: {e}")
+        return None
@@ -1,40 +1,187 @@
 import os
+from dataclasses import dataclass
+from functools import lru_cache
 from dotenv import load_dotenv
 
 load_dotenv()
 
-LIGHTHOUSE_API_KEY = os.getenv("LIGHTHOUSE_API_KEY")
-FVM_RPC_URL = os.getenv("FVM_RPC_URL")
-BACKEND_WALLET_PRIVATE_KEY = os.getenv("BACKEND_WALLET_PRIVATE_KEY")
-CONTRACT_ADDRESS = os.getenv("CONTRACT_ADDRESS")
-
-# Expected Frontend Origin (for SIWE domain validation)
-EXPECTED_FRONTEND_DOMAIN = os.getenv("EXPECTED_FRONTEND_DOMAIN", "localhost:3000") # Default to localhost:3000 for dev
-
-# JWT Settings
-JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
-JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
-JWT_ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("JWT_ACCESS_TOKEN_EXPIRE_MINUTES", 30))
-
-# --- Service Fees (in Wei) --- 
-# Load as string and convert to int, defaulting to 0 if not set or invalid
-try:
-    TRAINING_SERVICE_FEE = int(os.getenv("TRAINING_SERVICE_FEE", "0"))
-except ValueError:
-    print("Warning: Invalid TRAINING_SERVICE_FEE in .env file. Defaulting to 0.")
-    TRAINING_SERVICE_FEE = 0
-
-try:
-    INFERENCE_SERVICE_FEE = int(os.getenv("INFERENCE_SERVICE_FEE", "0"))
-except ValueError:
-    print("Warning: Invalid INFERENCE_SERVICE_FEE in .env file. Defaulting to 0.")
-    INFERENCE_SERVICE_FEE = 0
-
-# Basic validation
-if not LIGHTHOUSE_API_KEY:
-    print("Warning: LIGHTHOUSE_API_KEY not found in .env file.")
-if not FVM_RPC_URL:
-    print("Warning: FVM_RPC_URL not found in .env file.")
-if not JWT_SECRET_KEY:
-    print("Warning: JWT_SECRET_KEY not found in .env file. Authentication will fail.")
-# Add more checks as needed, especially for private key presence in production 
\ No newline at end of file
+
+def _int_env(name: str, default: int = 0) -> int:
+    """Reads an integer env var, falling back to the default if it's missing or invalid."""
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        print(f"Warning: Invalid {name} in .env file. Defaulting to {default}.")
+        return default
+
+
+@dataclass(frozen=True, slots=True)
+class Settings:
+    """Application settings, read from the environment once at startup."""
+    lighthouse_api_key: str | None
+    fvm_rpc_url: str | None
+    backend_wallet_private_key: str | None
+    contract_address: str | None
+    # Concurrent Range requests per large Lighthouse download (1 = single stream)
+    lighthouse_parallel_chunks: int
+    # Optional Redis for state shared across workers (nonces, training jobs)
+    redis_url: str | None
+    # How long a training job's record is kept in Redis after its last update (0 = forever)
+    job_ttl_seconds: int
+    # Expected Frontend Origin (for SIWE domain validation)
+    expected_frontend_domain: str
+    # Origins allowed by CORS
+    cors_allowed_origins: tuple[str, ...]
+    # Routers to mount; deployments that don't serve e.g. training skip its imports
+    enabled_routers: tuple[str, ...]
+    # Max number of loaded models kept in memory by the inference router,
+    # and how long an unused one stays (0 = no time limit)
+    model_cache_size: int
+    model_cache_ttl_seconds: int
+    # Directory for downloaded model files kept across restarts (disabled if unset)
+    model_cache_dir: str | None
+    # Directory for downloaded training datasets, reused by later jobs on the same CID
+    # (disabled if unset), and its size cap (0 = unbounded)
+    dataset_cache_dir: str | None
+    dataset_cache_dir_max_bytes: int
+    # Node-local directory for temporary files (datasets, trained models); system temp dir if unset
+    scratch_dir: str | None
+    # How long a finished or abandoned training job's working directory is kept
+    # (e.g. a model that's never uploaded) before it's deleted
+    job_dir_retention_seconds: int
+    # Size cap for model_cache_dir; least recently used files are evicted (0 = unbounded)
+    model_cache_dir_max_bytes: int
+    # Max blocking steps (downloads, joblib.load) of cold model loads running at once
+    model_load_concurrency: int
+    # Worker processes for deserializing joblib models off the GIL (0 = use threads)
+    model_load_workers: int
+    # Worker processes that run model training off the API process's GIL (0 = train in threads)
+    training_workers: int
+    # Training jobs that download and train at once; further jobs wait as QUEUED
+    max_concurrent_training_jobs: int
+    # Accepted jobs that may wait to start before new ones get 429 (0 = unbounded)
+    max_pending_training_jobs: int
+    # Where training jobs run: "background" (API server threadpool) or "celery" (needs REDIS_URL)
+    training_queue: str
+    # Format trained models are uploaded in: "joblib" or "onnx" (needs skl2onnx)
+    model_export_format: str
+    # Prediction micro-batching: how long to wait for more requests (0 = only
+    # batch requests that are already waiting) and the max batch size
+    predict_batch_window_ms: int
+    predict_batch_max_size: int
+    # How long prediction results are cached in Redis (0 = disabled; needs REDIS_URL)
+    predict_cache_ttl_seconds: int
+    # Models loaded and pinned at startup, as "model_cid" or "model_cid:model_info_cid"
+    preload_model_cids: tuple[str, ...]
+    # Shared secret for admin-only endpoints (disabled if unset)
+    admin_api_key: str | None
+    # JWT Settings
+    jwt_secret_key: str | None
+    jwt_algorithm: str
+    jwt_access_token_expire_minutes: int
+    # --- Service Fees (in Wei) ---
+    training_service_fee: int
+    inference_service_fee: int
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Loads the settings from the environment. Cached, so the env is only read once."""
+    settings = Settings(
+        lighthouse_api_key=os.getenv("LIGHTHOUSE_API_KEY"),
+        fvm_rpc_url=os.getenv("FVM_RPC_URL"),
+        backend_wallet_private_key=os.getenv("BACKEND_WALLET_PRIVATE_KEY"),
+        contract_address=os.getenv("CONTRACT_ADDRESS"),
+        lighthouse_parallel_chunks=_int_env("LIGHTHOUSE_PARALLEL_CHUNKS", 8),
+        redis_url=os.getenv("REDIS_URL"),
+        job_ttl_seconds=_int_env("JOB_TTL_SECONDS", 86400),
+        expected_frontend_domain=os.getenv("EXPECTED_FRONTEND_DOMAIN", "localhost:3000"), # Default to localhost:3000 for dev
+        cors_allowed_origins=tuple(
+            origin.strip() for origin in os.getenv("CORS_ALLOWED_ORIGINS", "http://localhost:3000").split(",") if origin.strip()
+        ),
+        enabled_routers=tuple(
+            name.strip() for name in os.getenv("ENABLED_ROUTERS", "auth,data,training,inference,provenance,models").split(",") if name.strip()
+        ),
+        model_cache_size=_int_env("MODEL_CACHE_SIZE", 8),
+        model_cache_ttl_seconds=_int_env("MODEL_CACHE_TTL_SECONDS", 0),
+        model_cache_dir=os.getenv("MODEL_CACHE_DIR") or None,
+        dataset_cache_dir=os.getenv("DATASET_CACHE_DIR") or None,
+        dataset_cache_dir_max_bytes=_int_env("DATASET_CACHE_DIR_MAX_BYTES", 0),
+        scratch_dir=os.getenv("SCRATCH_DIR") or None,
+        job_dir_retention_seconds=_int_env("JOB_DIR_RETENTION_SECONDS", 86400),
+        model_cache_dir_max_bytes=_int_env("MODEL_CACHE_DIR_MAX_BYTES", 0),
+        model_load_concurrency=_int_env("MODEL_LOAD_CONCURRENCY", 4),
+        model_load_workers=_int_env("MODEL_LOAD_WORKERS", 0),
+        training_workers=_int_env("TRAINING_WORKERS", 0),
+        max_concurrent_training_jobs=_int_env("MAX_CONCURRENT_TRAINING_JOBS", 2),
+        max_pending_training_jobs=_int_env("MAX_PENDING_TRAINING_JOBS", 20),
+        training_queue=os.getenv("TRAINING_QUEUE", "background").lower(),
+        model_export_format=os.getenv("MODEL_EXPORT_FORMAT", "joblib").lower(),
+        predict_batch_window_ms=_int_env("PREDICT_BATCH_WINDOW_MS", 0),
+        predict_batch_max_size=_int_env("PREDICT_BATCH_MAX_SIZE", 32),
+        predict_cache_ttl_seconds=_int_env("PREDICT_CACHE_TTL_SECONDS", 3600),
+        preload_model_cids=tuple(
+            cid.strip() for cid in os.getenv("PRELOAD_MODEL_CIDS", "").split(",") if cid.strip()
+        ),
+        admin_api_key=os.getenv("ADMIN_API_KEY") or None,
+        jwt_secret_key=os.getenv("JWT_SECRET_KEY"),
+        jwt_algorithm=os.getenv("JWT_ALGORITHM", "HS256"),
+        jwt_access_token_expire_minutes=_int_env("JWT_ACCESS_TOKEN_EXPIRE_MINUTES", 30),
+        training_service_fee=_int_env("TRAINING_SERVICE_FEE"),
+        inference_service_fee=_int_env("INFERENCE_SERVICE_FEE"),
+    )
+
+    # Basic validation
+    if not settings.lighthouse_api_key:
+        print("Warning: LIGHTHOUSE_API_KEY not found in .env file.")
+    if not settings.fvm_rpc_url:
+        print("Warning: FVM_RPC_URL not found in .env file.")
+    if settings.training_service_fee <= 0 and "training" in settings.enabled_routers:
+        print("Warning: TRAINING_SERVICE_FEE not set in .env file. Training requests will be rejected.")
+    if settings.training_queue == "celery" and not settings.redis_url:
+        print("Warning: TRAINING_QUEUE=celery needs REDIS_URL. Training jobs will run in the background instead.")
+    if not settings.jwt_secret_key:
+        print("Warning: JWT_SECRET_KEY not found in .env file. Authentication will fail.")
+    # Add more checks as needed, especially for private key presence in production
+
+    return settings
+
+
+# --- Module-level aliases for existing `config.X` callers ---
+_settings = get_settings()
+
+LIGHTHOUSE_API_KEY = _settings.lighthouse_api_key
+FVM_RPC_URL = _settings.fvm_rpc_url
+BACKEND_WALLET_PRIVATE_KEY = _settings.backend_wallet_private_key
+CONTRACT_ADDRESS = _settings.contract_address
+LIGHTHOUSE_PARALLEL_CHUNKS = _settings.lighthouse_parallel_chunks
+REDIS_URL = _settings.redis_url
+JOB_TTL_SECONDS = _settings.job_ttl_seconds
+EXPECTED_FRONTEND_DOMAIN = _settings.expected_frontend_domain
+CORS_ALLOWED_ORIGINS = _settings.cors_allowed_origins
+ENABLED_ROUTERS = _settings.enabled_routers
+MODEL_CACHE_SIZE = _settings.model_cache_size
+MODEL_CACHE_TTL_SECONDS = _settings.model_cache_ttl_seconds
+MODEL_CACHE_DIR = _settings.model_cache_dir
+DATASET_CACHE_DIR = _settings.dataset_cache_dir
+DATASET_CACHE_DIR_MAX_BYTES = _settings.dataset_cache_dir_max_bytes
+SCRATCH_DIR = _settings.scratch_dir
+JOB_DIR_RETENTION_SECONDS = _settings.job_dir_retention_seconds
+MODEL_CACHE_DIR_MAX_BYTES = _settings.model_cache_dir_max_bytes
+MODEL_LOAD_CONCURRENCY = _settings.model_load_concurrency
+MODEL_LOAD_WORKERS = _settings.model_load_workers
+TRAINING_WORKERS = _settings.training_workers
+MAX_CONCURRENT_TRAINING_JOBS = _settings.max_concurrent_training_jobs
+MAX_PENDING_TRAINING_JOBS = _settings.max_pending_training_jobs
+TRAINING_QUEUE = _settings.training_queue
+MODEL_EXPORT_FORMAT = _settings.model_export_format
+PREDICT_BATCH_WINDOW_MS = _settings.predict_batch_window_ms
+PREDICT_BATCH_MAX_SIZE = _settings.predict_batch_max_size
+PREDICT_CACHE_TTL_SECONDS = _settings.predict_cache_ttl_seconds
+PRELOAD_MODEL_CIDS = _settings.preload_model_cids
+ADMIN_API_KEY = _settings.admin_api_key
+JWT_SECRET_KEY = _settings.jwt_secret_key
+JWT_ALGORITHM = _settings.jwt_algorithm
+JWT_ACCESS_TOKEN_EXPIRE_MINUTES = _settings.jwt_access_token_expire_minutes
+TRAINING_SERVICE_FEE = _settings.training_service_fee
+INFERENCE_SERVICE_FEE = _settings.inference_service_fee
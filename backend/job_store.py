@@ -1,45 +1,202 @@
 # backend/job_store.py
 
+import asyncio
 import logging
+import orjson
+import time
+from dataclasses import dataclass, asdict, fields, replace
 from datetime import datetime, timezone
-from typing import Dict, Any
+from typing import AsyncIterator, Dict, Any, Optional
 
 from .models.data_models import TrainingStatusResponse # Assuming data_models is in the parent dir
+from .services.redis_service import async_redis_client, redis_client
+from . import config
 
 logger = logging.getLogger(__name__)
 
+@dataclass(slots=True)
+class JobRecord:
+    """
+    Stored state of a training job. Mirrors TrainingStatusResponse, which is
+    only built from this at the HTTP edge (see to_status_response).
+    """
+    job_id: str
+    status: str
+    dataset_cid: str
+    owner_address: str
+    message: Optional[str] = None
+    model_cid: Optional[str] = None
+    model_info_cid: Optional[str] = None
+    accuracy: Optional[float] = None
+    fvm_tx_hash: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    temp_model_path: Optional[str] = None
+    temp_info_path: Optional[str] = None
+
+def to_status_response(job: JobRecord) -> TrainingStatusResponse:
+    """Builds the API response model for a stored job."""
+    return TrainingStatusResponse(**asdict(job))
+
+# Valid JobRecord field names, for set-membership checks on updates
+_JOB_FIELDS = frozenset(f.name for f in fields(JobRecord))
+_DATETIME_FIELDS = ("created_at", "updated_at")
+
 # --- In-Memory Job Store (Basic Example) ---
-# Stores job_id -> TrainingStatusResponse object
-# WARNING: This is lost on server restart! Consider a persistent store (e.g., Redis, DB) for production.
-_training_jobs: Dict[str, TrainingStatusResponse] = {}
+# Stores job_id -> JobRecord
+# Used when REDIS_URL is not configured. WARNING: This is lost on server restart
+# and is not shared between workers.
+# Records are never mutated once stored: updates swap in a new record (a single
+# dict assignment, atomic under the GIL), so a reader holding a record from
+# get_job always sees a consistent snapshot without any locking.
+_training_jobs: Dict[str, JobRecord] = {}
+
+# --- Redis Job Store ---
+# Each job is a hash at job:{job_id}, one field per JobRecord attribute.
+# Field values are JSON-encoded (with orjson) so None/float/datetime round-trip cleanly.
+# Every write also resets the key's expiry to JOB_TTL_SECONDS, so finished jobs
+# evict themselves a while after their last update.
+_REDIS_JOB_PREFIX = "job:"
+
+# Status changes are also published on the channel jobevents:{job_id} (the new
+# status as the message), so watch_job can push them instead of clients polling.
+_REDIS_JOB_EVENTS_PREFIX = "jobevents:"
+
+# Updates an existing job hash (KEYS[1]) and refreshes its expiry (ARGV[1], 0 = none)
+# with the field/value pairs in ARGV[4:], then publishes ARGV[3] on channel ARGV[2].
+# Returns 0 without writing if the job is unknown or already expired. Running
+# server-side, the check, write and publish are one atomic round trip: no lock is
+# held in Python, and a job that expires in between can't be re-created as a partial hash.
+_UPDATE_JOB_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 4))
+if tonumber(ARGV[1]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+redis.call('PUBLISH', ARGV[2], ARGV[3])
+return 1
+"""
+_update_job_script = redis_client.register_script(_UPDATE_JOB_SCRIPT) if redis_client else None
 
-def get_job(job_id: str) -> TrainingStatusResponse | None:
+def _write_fields(redis_key: str, values: Dict[str, Any]):
+    """Writes fields to a job hash and refreshes its expiry, in one round trip."""
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hset(redis_key, mapping=_encode_fields(values))
+    if config.JOB_TTL_SECONDS > 0:
+        pipe.expire(redis_key, config.JOB_TTL_SECONDS)
+    pipe.execute()
+
+def _encode_fields(values: Dict[str, Any]) -> Dict[str, bytes]:
+    """JSON-encodes field values for storage in a Redis hash. Datetimes become ISO 8601 strings."""
+    return {key: orjson.dumps(value) for key, value in values.items()}
+
+def _decode_fields(raw: Dict[str, str]) -> JobRecord:
+    """Rebuilds a JobRecord from a Redis hash."""
+    values = {key: orjson.loads(value) for key, value in raw.items() if key in _JOB_FIELDS}
+    for key in _DATETIME_FIELDS:
+        if values.get(key):
+            values[key] = datetime.fromisoformat(values[key])
+    return JobRecord(**values)
+
+def get_job(job_id: str) -> JobRecord | None:
     """Retrieve a job from the store by its ID."""
+    if redis_client:
+        raw = redis_client.hgetall(f"{_REDIS_JOB_PREFIX}{job_id}")
+        return _decode_fields(raw) if raw else None
     return _training_jobs.get(job_id)
 
-def store_job(job: TrainingStatusResponse):
+async def _get_job_async(job_id: str) -> JobRecord | None:
+    """get_job over the async Redis client, for use on the event loop (watch_job)."""
+    raw = await async_redis_client.hgetall(f"{_REDIS_JOB_PREFIX}{job_id}")
+    # The async client doesn't decode responses; values are JSON, which orjson reads as bytes
+    return _decode_fields({key.decode(): value for key, value in raw.items()}) if raw else None
+
+def store_job(job: JobRecord):
     """Store or update a job in the store."""
     if not job or not job.job_id:
         logger.error("Attempted to store an invalid job object.")
         return
-    _training_jobs[job.job_id] = job
+    if redis_client:
+        _write_fields(f"{_REDIS_JOB_PREFIX}{job.job_id}", asdict(job))
+    else:
+        _training_jobs[job.job_id] = job
     logger.debug(f"Stored/Updated job {job.job_id}")
 
+def delete_job(job_id: str):
+    """Remove a job from the store, e.g. one created for a request that was then turned away."""
+    if redis_client:
+        redis_client.delete(f"{_REDIS_JOB_PREFIX}{job_id}")
+    else:
+        _training_jobs.pop(job_id, None)
+    logger.debug(f"Deleted job {job_id}")
+
 def update_job_status(job_id: str, status: str, message: str | None = None, **kwargs):
     """Helper to update the status and other attributes of a job in the store."""
-    job = get_job(job_id)
+    updates = {"status": status, "message": message, "updated_at": datetime.now(timezone.utc)}
+    for key, value in kwargs.items():
+        if key in _JOB_FIELDS:
+            updates[key] = value
+        else:
+             logger.warning(f"Job {job_id}: Attempted to set unknown attribute '{key}' during status update.")
+
+    if redis_client:
+        # Fields are encoded before the call, so only the script runs against Redis
+        field_args = [item for pair in _encode_fields(updates).items() for item in pair]
+        script_args = [config.JOB_TTL_SECONDS, f"{_REDIS_JOB_EVENTS_PREFIX}{job_id}", status, *field_args]
+        if not _update_job_script(keys=[f"{_REDIS_JOB_PREFIX}{job_id}"], args=script_args):
+            logger.warning(f"Attempted to update status for unknown job_id: {job_id}")
+            return
+        logger.info(f"Updated job {job_id} status to {status} (kwargs: {list(kwargs.keys())})")
+        return
+
+    job = _training_jobs.get(job_id)
     if job:
-        job.status = status
-        job.message = message
-        job.updated_at = datetime.now(timezone.utc)
-        # Update result fields if provided
-        for key, value in kwargs.items():
-            if hasattr(job, key):
-                setattr(job, key, value)
-            else:
-                 logger.warning(f"Job {job_id}: Attempted to set unknown attribute '{key}' during status update.")
-        # Re-store the updated job object
-        store_job(job)
+        # Copy-on-write: replace the record rather than mutating the one readers may hold
+        _training_jobs[job_id] = replace(job, **updates)
         logger.info(f"Updated job {job_id} status to {status} (kwargs: {list(kwargs.keys())})")
     else:
-        logger.warning(f"Attempted to update status for unknown job_id: {job_id}") 
\ No newline at end of file
+        logger.warning(f"Attempted to update status for unknown job_id: {job_id}")
+
+# How often watch_job checks the in-memory store for changes (no Redis to push them)
+_WATCH_POLL_INTERVAL_SECONDS = 0.5
+# How often a Redis watch checks that its job still exists. Expiry and delete_job
+# publish nothing, so without this a watch on a vanished job would wait forever.
+_WATCH_RECHECK_SECONDS = 30.0
+
+async def watch_job(job_id: str) -> AsyncIterator[JobRecord]:
+    """
+    Yields a job's current record, then the new record each time its status is updated.
+    Ends if the job disappears (unknown or expired). Callers stop iterating when done.
+    """
+    if async_redis_client:
+        pubsub = async_redis_client.pubsub()
+        # Subscribe before the first read, so no update can slip in between
+        await pubsub.subscribe(f"{_REDIS_JOB_EVENTS_PREFIX}{job_id}")
+        try:
+            job = await _get_job_async(job_id)
+            while job:
+                yield job
+                # Short waits in a loop: reads must stay under the client's socket_timeout
+                recheck_at = time.monotonic() + _WATCH_RECHECK_SECONDS
+                while await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0) is None:
+                    if time.monotonic() >= recheck_at:
+                        if not await async_redis_client.exists(f"{_REDIS_JOB_PREFIX}{job_id}"):
+                            return
+                        recheck_at = time.monotonic() + _WATCH_RECHECK_SECONDS
+                job = await _get_job_async(job_id)
+        finally:
+            await pubsub.aclose()
+        return
+
+    # Records are replaced on every update (see _training_jobs), so a change is
+    # just a different object
+    job = _training_jobs.get(job_id)
+    while job:
+        yield job
+        current = job
+        while current is job:
+            await asyncio.sleep(_WATCH_POLL_INTERVAL_SECONDS)
+            current = _training_jobs.get(job_id)
+        job = current
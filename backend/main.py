@@ -1,43 +1,91 @@
-from fastapi import FastAPI
+import asyncio
+import importlib
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 import logging # Add logging config
 
 # Configure basic logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-# Import routers
-from .routers import data, training, inference, auth, provenance, models # Add models router
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# Routers that can be mounted, in include order. Only the ones listed in
+# ENABLED_ROUTERS are imported, so e.g. an inference-only deployment never
+# pays for the training/ML import tree at cold start.
+_AVAILABLE_ROUTERS = ("auth", "data", "training", "inference", "provenance", "models")
+_JOB_DIR_REAP_INTERVAL_SECONDS = 300
+
+async def _reap_job_dirs_periodically():
+    """Deletes working directories of finished or abandoned training jobs every few minutes."""
+    from . import scratch
+    while True:
+        try:
+            await run_in_threadpool(scratch.reap_job_dirs)
+        except Exception as e:
+            logger.error(f"Error reaping training job directories: {e}", exc_info=True)
+        await asyncio.sleep(_JOB_DIR_REAP_INTERVAL_SECONDS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Model warmup runs in the background so the server starts accepting
+    # (health check) connections right away; /ready reports when it's done.
+    warmup_task = None
+    if config.PRELOAD_MODEL_CIDS and "inference" in config.ENABLED_ROUTERS:
+        from .routers import inference
+        warmup_task = asyncio.create_task(inference.warmup_models())
+    # Training jobs leave their directory behind until the model is uploaded
+    reaper_task = None
+    if "training" in config.ENABLED_ROUTERS:
+        reaper_task = asyncio.create_task(_reap_job_dirs_periodically())
+    yield
+    if warmup_task and not warmup_task.done():
+        warmup_task.cancel()
+    if reaper_task:
+        reaper_task.cancel()
+    if "inference" in config.ENABLED_ROUTERS:
+        from .routers import inference
+        inference.shutdown_load_pool()
+    if "training" in config.ENABLED_ROUTERS:
+        from .services import training_pipeline
+        training_pipeline.shutdown_train_pool()
+    # Release pooled connections
+    from .services import lighthouse_service, redis_service
+    lighthouse_service.close_session()
+    if redis_service.async_redis_client:
+        await redis_service.async_redis_client.aclose()
 
 app = FastAPI(
     title="Decentralized AI Platform Backend",
     description="API for managing ML datasets and models with Filecoin storage and FVM provenance.",
-    version="0.1.0"
+    version="0.1.0",
+    default_response_class=ORJSONResponse, # orjson serializes responses (incl. datetimes) in C
+    lifespan=lifespan,
 )
 
 # --- CORS Configuration ---
-# Define allowed origins (adjust as needed for production)
-# For development, allow the Next.js frontend origin
-origins = [
-    "http://localhost:3000", # Next.js frontend
-    # Add your deployed frontend URL here for production
-    # e.g., "https://your-frontend-domain.com",
-]
-
+# Allowed origins come from CORS_ALLOWED_ORIGINS (comma-separated).
+# Defaults to the Next.js dev frontend at http://localhost:3000.
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=origins,  # List of origins that are allowed to make requests
+    allow_origins=list(config.CORS_ALLOWED_ORIGINS), # Origins that are allowed to make requests
     allow_credentials=True, # Allow cookies/authorization headers
-    allow_methods=["*"],    # Allow all methods (GET, POST, etc.)
-    allow_headers=["*"],    # Allow all headers
+    # Explicit lists instead of "*": only what the frontend actually sends
+    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_headers=["Authorization", "Content-Type"],
 )
 
 # Include routers
-app.include_router(auth.router) # Include auth router
-app.include_router(data.router)
-app.include_router(training.router) # Include training router
-app.include_router(inference.router) # Include inference router
-app.include_router(provenance.router) # Include provenance router
-app.include_router(models.router) # Include the new models router
+for _name in config.ENABLED_ROUTERS:
+    if _name not in _AVAILABLE_ROUTERS:
+        logger.warning(f"Unknown router '{_name}' in ENABLED_ROUTERS, skipping.")
+        continue
+    app.include_router(importlib.import_module(f".routers.{_name}", __package__).router)
 
 
 @app.get("/", tags=["Health Check"])
@@ -45,18 +93,19 @@ def read_root():
     """Root endpoint for health check."""
     return {"status": "ok", "message": "Welcome to the Decentralized AI Platform Backend!"}
 
-# --- Placeholder Endpoints (to be implemented) ---
-
-# TODO: Authentication endpoints (SIWE)
-
-# TODO: Dataset upload endpoint
-
-# TODO: Model training endpoint
-
-# TODO: Model inference endpoint
-
-# TODO: Provenance query endpoints (FVM interaction)
-
+@app.get("/ready", tags=["Health Check"])
+def read_ready():
+    """Readiness probe: 503 until the models in PRELOAD_MODEL_CIDS have been warmed up."""
+    if config.PRELOAD_MODEL_CIDS and "inference" in config.ENABLED_ROUTERS:
+        from .routers import inference
+        if not inference.warmup_complete:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Model warmup in progress.")
+    return {"status": "ready"}
+
+@app.get("/metrics", tags=["Health Check"], include_in_schema=False)
+def read_metrics():
+    """Prometheus metrics, including per-stage inference timings."""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 # --- Server Startup (for local development) ---
 if __name__ == "__main__":
@@ -0,0 +1,38 @@
+# backend/metrics.py
+
+import logging
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from prometheus_client import Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# --- Inference Stage Timings ---
+# Time spent in each stage of serving a prediction, so cold-miss latency can be
+# attributed to Lighthouse, deserialization or the FVM lookup. Exposed on /metrics.
+INFERENCE_STAGE_SECONDS = Histogram(
+    "inference_stage_seconds",
+    "Time spent in each stage of model loading and prediction.",
+    ["stage"],
+)
+
+# --- Training Queue ---
+# Accepted training jobs that haven't started running, for autoscaling workers on
+# queue length. The training router supplies the value at scrape time.
+TRAINING_QUEUE_DEPTH = Gauge(
+    "training_queue_depth",
+    "Training jobs accepted but not yet running.",
+)
+
+@contextmanager
+def time_stage(stage: str, subject: str = "") -> Iterator[None]:
+    """Records how long the block takes under the given stage, and logs it at DEBUG."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        INFERENCE_STAGE_SECONDS.labels(stage=stage).observe(elapsed)
+        logger.debug(f"Stage {stage} {subject} took {elapsed * 1000:.1f} ms")
@@ -1,14 +1,15 @@
-from pydantic import BaseModel, Field
-from typing import Dict, Any
+from pydantic import BaseModel, ConfigDict, Field
 
 class NonceResponse(BaseModel):
+    model_config = ConfigDict(frozen=True, extra='forbid') # Response-only DTO
     nonce: str = Field(..., description="Unique nonce for the SIWE message.")
 
 class VerifyRequest(BaseModel):
-    message: Dict[str, Any] = Field(..., description="The dictionary representing the SIWE message fields.")
+    message: str = Field(..., description="The EIP-4361 (SIWE) message string exactly as signed by the user.")
     signature: str = Field(..., description="The signature provided by the user's wallet.")
 
 class VerifyResponse(BaseModel):
+    model_config = ConfigDict(frozen=True, extra='forbid') # Response-only DTO
     status: str = "ok"
     address: str = Field(..., description="The verified Ethereum address of the user.")
     # Add JWT access token
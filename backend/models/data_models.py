@@ -1,8 +1,9 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Dict, Any, Optional
 from datetime import datetime
 
 class UploadResponse(BaseModel):
+    model_config = ConfigDict(frozen=True, extra='forbid') # Response-only DTO
     filename: str
     content_type: str
     cid: str = Field(..., description="Content Identifier (CID) of the uploaded file on Lighthouse/IPFS")
@@ -71,12 +72,22 @@ class InferenceResponse(BaseModel):
     # Optional: include input_data in response? Can be large.
     # input_data: Dict[str, Any] 
 
+class PreloadModelRequest(BaseModel):
+    model_cid: str = Field(..., description="CID of the trained model (.joblib) to load.")
+    model_info_cid: Optional[str] = Field(None, description="Optional CID of the model metadata file (.json).")
+
+class PreloadModelResponse(BaseModel):
+    model_config = ConfigDict(frozen=True, extra='forbid') # Response-only DTO
+    model_cid: str
+    model_info_cid: Optional[str] = None
+    pinned: bool = Field(..., description="Whether the model is now pinned in the inference cache.")
+
 # --- Models for the new Upload endpoint --- 
 class UploadTrainedModelRequest(BaseModel):
     model_name: Optional[str] = Field(None, description="Optional name to use for the model registration.")
 
 class UploadTrainedModelResponse(BaseModel):
-    model_cid: str
-    model_info_cid: str
-    fvm_tx_hash: Optional[str] = None # FVM hash might be None if registration fails
-    message: str = "Model uploaded and provenance registered successfully." 
\ No newline at end of file
+    job_id: str
+    status: str = "UPLOADING_MODEL"
+    # The CIDs and FVM tx hash are reported by the job status once the upload finishes
+    message: str = "Model upload started. Check the job status for the result." 
\ No newline at end of file
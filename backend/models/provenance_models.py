@@ -1,7 +1,8 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List
 
 class AssetRecord(BaseModel):
+    model_config = ConfigDict(frozen=True, extra='forbid') # Response-only DTO
     owner: str = Field(..., description="Address of the user who registered the asset.")
     assetType: str = Field(..., description="Type of the asset (e.g., 'Dataset', 'Model').")
     name: str = Field(..., description="Name of the asset (e.g., filename).")
@@ -11,14 +12,12 @@ class AssetRecord(BaseModel):
     timestamp: int = Field(..., description="Unix timestamp of registration.")
     txHash: str = Field(..., description="Transaction hash of the registration event.")
 
-    # Remove orm_mode if not using ORM
-    # class Config:
-    #     orm_mode = True
-
 class ProvenanceResponse(BaseModel):
+    model_config = ConfigDict(frozen=True, extra='forbid') # Response-only DTO
     # For returning a single record
     record: AssetRecord | None = None
 
 class ProvenanceListResponse(BaseModel):
+    model_config = ConfigDict(frozen=True, extra='forbid') # Response-only DTO
     # For returning multiple records
     records: List[AssetRecord] = [] 
\ No newline at end of file
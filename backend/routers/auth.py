@@ -1,26 +1,69 @@
 from fastapi import APIRouter, HTTPException, status, Request, Depends
-from fastapi.security import OAuth2PasswordBearer # For JWT extraction
-from siwe import SiweMessage, generate_nonce
-from datetime import datetime, timedelta, timezone # Added timezone
-from jose import JWTError, jwt # For JWT handling
-from pydantic import BaseModel, ValidationError # For token payload validation
+from fastapi.security import OAuth2PasswordBearer, APIKeyHeader # For JWT / admin key extraction
+from siwe import SiweMessage
+from datetime import datetime
+import hashlib
+import heapq
+import hmac
+import re
+import secrets
+import threading
+import time
+from cachetools import TTLCache
+from coincurve import PublicKey
+from eth_utils import keccak
+import jwt # PyJWT, for JWT handling
 import logging
 
 from ..models.auth_models import NonceResponse, VerifyRequest, VerifyResponse
 from ..models.data_models import ErrorResponse
-from .. import config # Import config for JWT settings
+from ..services.redis_service import redis_client
+from ..config import get_settings
+
+_S = get_settings() # Settings are frozen at startup, read once
+
+# Precomputed once so encode/decode don't rebuild them per request
+_JWT_SIGNING_KEY = _S.jwt_secret_key.encode() if _S.jwt_secret_key else None
+_JWT_ALGORITHMS = (_S.jwt_algorithm,)
+
+# Key for authenticating issued nonces, derived from the JWT secret so every
+# worker accepts nonces issued by any other. Without a JWT secret nothing can
+# be verified anyway; a per-process key keeps /nonce working for development.
+_NONCE_KEY = (
+    hmac.new(_JWT_SIGNING_KEY, b"siwe-nonce", hashlib.sha256).digest()
+    if _JWT_SIGNING_KEY else secrets.token_bytes(32)
+)
+
+# Recently verified tokens: token -> (address, exp). Clients replay the same
+# bearer token on every request, so hits skip the HMAC check and claim parsing.
+# Only touched from the async dependency on the event loop, so no lock is needed.
+_token_cache: TTLCache[str, tuple[str, float]] = TTLCache(maxsize=4096, ttl=60)
 
 # --- JWT Configuration ---
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token") # Dummy URL, we use /verify
+admin_key_scheme = APIKeyHeader(name="X-Admin-Key", auto_error=False)
 
-# --- Token Payload Model ---
-class TokenData(BaseModel):
-    sub: str # Subject (typically the user identifier, e.g., address)
-    # Add other claims like roles if needed
-
-# In-memory store for nonces (replace with Redis/DB in production)
-_nonce_store: dict[str, datetime] = {}
+# Nonces are stateless: each one carries its issue time and an HMAC tag, so
+# /nonce stores nothing. Only redeemed nonces are remembered, until they would
+# have expired anyway, to reject replays.
+# In-memory store of redeemed nonces, used when REDIS_URL is not configured.
+# Maps nonce -> expiry (time.monotonic() seconds). The heap orders the same
+# entries by expiry so cleanup only touches nonces that have actually expired.
+# The endpoints are sync and run in the threadpool, so every access to the
+# store and heap goes through _nonce_lock.
+_nonce_store: dict[str, float] = {}
+_nonce_expiry_heap: list[tuple[float, str]] = []
+_nonce_lock = threading.Lock()
 NONCE_EXPIRATION_SECONDS = 300
+# Expired entries are swept at most this often when a nonce is redeemed.
+# Redemption checks expiry itself, so a late sweep only delays freeing memory.
+_NONCE_CLEANUP_INTERVAL_SECONDS = 10
+_last_nonce_cleanup = 0.0
+_REDIS_NONCE_PREFIX = "siwe:nonce:"
+
+# Raw-text patterns for the pre-checks in verify_signature
+_SIWE_HEADER_SUFFIX = " wants you to sign in with your Ethereum account:"
+_SIWE_NONCE_RE = re.compile(r"^Nonce: ([a-zA-Z0-9]+)$", re.MULTILINE)
 
 router = APIRouter(
     prefix="/auth",
@@ -31,29 +74,99 @@ logger = logging.getLogger(__name__)
 
 # --- Helper Functions ---
 def cleanup_expired_nonces():
-    """Removes expired nonces from the store."""
-    now = datetime.now(timezone.utc) # Use timezone-aware datetime
-    expired_keys = [
-        key for key, timestamp in _nonce_store.items()
-        if (now - timestamp).total_seconds() > NONCE_EXPIRATION_SECONDS
-    ]
-    for key in expired_keys:
-        try:
+    """
+    Removes expired nonces from the store, popping only the expired heap head.
+    Callers must hold _nonce_lock.
+    """
+    now = time.monotonic()
+    while _nonce_expiry_heap and _nonce_expiry_heap[0][0] < now:
+        expiry, key = heapq.heappop(_nonce_expiry_heap)
+        # Skip heap entries whose nonce was already consumed
+        if _nonce_store.get(key) == expiry:
             del _nonce_store[key]
             logger.debug(f"Expired nonce removed: {key}")
-        except KeyError:
-            pass
 
-def create_access_token(data: dict, expires_delta: timedelta | None = None) -> str:
+def issue_nonce() -> str:
+    """
+    Creates a nonce as hex(issued_at || random || tag), where tag is a truncated
+    HMAC of the first two parts. Hex keeps it alphanumeric as EIP-4361 requires.
+    """
+    body = int(time.time()).to_bytes(4, "big") + secrets.token_bytes(8)
+    tag = hmac.new(_NONCE_KEY, body, hashlib.sha256).digest()[:8]
+    return (body + tag).hex()
+
+def nonce_seconds_left(nonce: str) -> float:
+    """
+    Checks that a nonce was issued by this service and hasn't expired.
+    Returns the seconds until it expires. Raises ValueError otherwise.
+    """
+    try:
+        raw = bytes.fromhex(nonce)
+    except ValueError:
+        raise ValueError("Malformed nonce.") from None
+    if len(raw) != 20:
+        raise ValueError("Malformed nonce.")
+    body, tag = raw[:12], raw[12:]
+    if not hmac.compare_digest(tag, hmac.new(_NONCE_KEY, body, hashlib.sha256).digest()[:8]):
+        raise ValueError("Nonce was not issued by this service.")
+    seconds_left = int.from_bytes(body[:4], "big") + NONCE_EXPIRATION_SECONDS - time.time()
+    if seconds_left <= 0:
+        raise ValueError("Nonce has expired.")
+    return seconds_left
+
+def redeem_nonce(nonce: str, seconds_left: float) -> bool:
+    """
+    Marks a valid nonce as used. Returns False if it was already redeemed.
+    The check and the write are a single atomic step.
+    """
+    if redis_client:
+        # SET NX succeeds for exactly one caller; the key expires with the nonce
+        return bool(redis_client.set(f"{_REDIS_NONCE_PREFIX}{nonce}", "1", nx=True, ex=max(1, int(seconds_left) + 1)))
+
+    global _last_nonce_cleanup
+    now = time.monotonic()
+    expiry = now + seconds_left
+    with _nonce_lock:
+        if now - _last_nonce_cleanup >= _NONCE_CLEANUP_INTERVAL_SECONDS:
+            cleanup_expired_nonces()
+            _last_nonce_cleanup = now
+        if nonce in _nonce_store:
+            return False
+        heapq.heappush(_nonce_expiry_heap, (expiry, nonce))
+        _nonce_store[nonce] = expiry
+    return True
+
+def recover_signer_address(message: str, signature: str) -> str:
+    """
+    Recovers the address that personal_sign'ed (EIP-191) the given message.
+    Uses libsecp256k1 via coincurve for the public key recovery.
+    Raises ValueError if the signature is malformed.
+    """
+    sig = bytes.fromhex(signature.removeprefix("0x"))
+    if len(sig) != 65:
+        raise ValueError("Invalid signature length.")
+    recovery_id = sig[64] - 27 if sig[64] >= 27 else sig[64]
+    if recovery_id not in (0, 1):
+        raise ValueError("Invalid signature recovery id.")
+
+    message_bytes = message.encode("utf-8")
+    digest = keccak(b"\x19Ethereum Signed Message:\n" + str(len(message_bytes)).encode() + message_bytes)
+    try:
+        public_key = PublicKey.from_signature_and_message(sig[:64] + bytes([recovery_id]), digest, hasher=None)
+    except Exception as e:
+        raise ValueError(f"Could not recover public key from signature: {e}") from e
+    # Address is the last 20 bytes of keccak(uncompressed pubkey without the 0x04 prefix)
+    return "0x" + keccak(public_key.format(compressed=False)[1:])[-20:].hex()
+
+def create_access_token(data: dict, expires_in_seconds: int | None = None) -> str:
     """Creates a JWT access token."""
     to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.now(timezone.utc) + expires_delta
-    else:
+    if expires_in_seconds is None:
         # Default expiry from config
-        expire = datetime.now(timezone.utc) + timedelta(minutes=config.JWT_ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, config.JWT_SECRET_KEY, algorithm=config.JWT_ALGORITHM)
+        expires_in_seconds = _S.jwt_access_token_expire_minutes * 60
+    # 'exp' is a plain epoch integer, no datetime/timedelta objects needed
+    to_encode["exp"] = int(time.time()) + expires_in_seconds
+    encoded_jwt = jwt.encode(to_encode, _JWT_SIGNING_KEY, algorithm=_S.jwt_algorithm)
     return encoded_jwt
 
 # --- API Endpoints ---
@@ -61,10 +174,9 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None) -> s
 def get_nonce():
     """
     Generates a unique nonce for the client to use in the SIWE message.
+    Nothing is stored; the nonce authenticates itself (see issue_nonce).
     """
-    cleanup_expired_nonces()
-    nonce = generate_nonce()
-    _nonce_store[nonce] = datetime.now(timezone.utc) # Use timezone-aware datetime
+    nonce = issue_nonce()
     logger.info(f"Generated nonce: {nonce}")
     return NonceResponse(nonce=nonce)
 
@@ -80,62 +192,68 @@ def verify_signature(verify_request: VerifyRequest, request: Request):
     Checks message structure, signature, domain, and nonce.
     If successful, generates a JWT containing the user's address.
 
-    - **message**: The structured SIWE message signed by the user.
+    - **message**: The EIP-4361 message string signed by the user.
     - **signature**: The hex-encoded signature string.
     """
     try:
-        # Parse the message by creating SiweMessage from the dictionary
-        # Unpack the dictionary received in verify_request.message
-        siwe_message = SiweMessage(**verify_request.message)
-        
-        # Verify the signature against the constructed message object.
-        # The nonce/domain/etc. are part of the siwe_message object now.
-        siwe_message.verify(verify_request.signature)
-        
-        logger.info(f"SIWE signature verified successfully for address: {siwe_message.address}")
+        # Checks are ordered cheapest first, so bogus requests are rejected
+        # before the full EIP-4361 parse and the signature recovery.
 
-        # --- Nonce Validation --- 
-        # Check if nonce exists in our store and is not expired
-        now = datetime.now(timezone.utc) # Use timezone-aware
-        nonce_creation_time = _nonce_store.get(siwe_message.nonce)
-        
-        if not nonce_creation_time:
-            logger.warning(f"SIWE nonce not found or already used: {siwe_message.nonce}")
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired nonce.")
-
-        if (now - nonce_creation_time).total_seconds() > NONCE_EXPIRATION_SECONDS:
-            logger.warning(f"SIWE nonce expired: {siwe_message.nonce}")
-            try: del _nonce_store[siwe_message.nonce]
-            except KeyError: pass
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Expired nonce.")
-        
         # --- Domain Validation --- 
         # Compare against the expected frontend domain from config
-        expected_domain = config.EXPECTED_FRONTEND_DOMAIN # Assumes this exists in config
+        expected_domain = _S.expected_frontend_domain
         
         if not expected_domain:
             # Configuration error
             logger.error("Missing EXPECTED_FRONTEND_DOMAIN configuration.")
             # Don't expose config details, raise a generic internal error
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Server configuration error.")
-        
-        if siwe_message.domain != expected_domain:
-             logger.warning(f"SIWE domain mismatch: Expected '{expected_domain}', Got '{siwe_message.domain}'")
+
+        # Pre-check on the raw header line; confirmed on the parsed message below
+        header_domain = verify_request.message.partition("\n")[0].removesuffix(_SIWE_HEADER_SUFFIX)
+        if header_domain.rpartition("://")[2] != expected_domain:
+             logger.warning(f"SIWE domain mismatch: Expected '{expected_domain}', Got '{header_domain}'")
              raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Domain mismatch. Signature is not valid for this application.") # More generic error message
 
-        # --- Consume Nonce --- 
+        # --- Nonce Validation --- 
+        # Check the nonce's tag and age (an HMAC, no store lookup). It is only
+        # redeemed once the signature is known to be valid.
+        nonce_match = _SIWE_NONCE_RE.search(verify_request.message)
+        nonce = nonce_match.group(1) if nonce_match else ""
         try:
-            del _nonce_store[siwe_message.nonce]
-            logger.info(f"Nonce consumed: {siwe_message.nonce}")
-        except KeyError:
-             logger.error(f"Attempted to consume nonce {siwe_message.nonce} that was already removed.")
-             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Nonce already used.")
+            seconds_left = nonce_seconds_left(nonce)
+        except ValueError as e:
+            logger.warning(f"SIWE nonce rejected ({e}): {nonce}")
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired nonce.")
+
+        # Parse the canonical EIP-4361 message string that the user signed
+        siwe_message = SiweMessage.from_message(message=verify_request.message)
+        if siwe_message.domain != expected_domain or siwe_message.nonce != nonce:
+            raise ValueError("Message fields don't match the message header.")
+        
+        # Check the message validity window (what SiweMessage.verify would check).
+        # Both fields are optional and usually absent, so only parse them when set.
+        if siwe_message.expiration_time and time.time() >= datetime.fromisoformat(str(siwe_message.expiration_time)).timestamp():
+            raise ValueError("Message has expired.")
+        if siwe_message.not_before and time.time() < datetime.fromisoformat(str(siwe_message.not_before)).timestamp():
+            raise ValueError("Message is not yet valid.")
+
+        # Verify the signature against the exact string that was signed
+        signer = recover_signer_address(verify_request.message, verify_request.signature)
+        if signer.lower() != siwe_message.address.lower():
+            raise ValueError("Signature does not match the message address.")
+        
+        logger.info(f"SIWE signature verified successfully for address: {siwe_message.address}")
+
+        # --- Consume Nonce --- 
+        # Redeemed in a single atomic step, so two concurrent requests can't both use it
+        if not redeem_nonce(nonce, seconds_left):
+            logger.warning(f"SIWE nonce already used: {nonce}")
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired nonce.")
+        logger.info(f"Nonce consumed: {nonce}")
 
         # --- Verification Successful - Generate JWT ---
-        access_token_expires = timedelta(minutes=config.JWT_ACCESS_TOKEN_EXPIRE_MINUTES)
-        access_token = create_access_token(
-            data={"sub": siwe_message.address}, expires_delta=access_token_expires
-        )
+        access_token = create_access_token(data={"sub": siwe_message.address})
         logger.info(f"JWT generated successfully for address: {siwe_message.address}")
 
         return VerifyResponse(
@@ -161,6 +279,10 @@ async def get_current_active_user(token: str = Depends(oauth2_scheme)) -> str:
     and returns the user's address (subject of the token).
     Raises HTTPException 401 if the token is invalid or expired.
     """
+    cached = _token_cache.get(token)
+    if cached and cached[1] > time.time():
+        return cached[0]
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -168,45 +290,37 @@ async def get_current_active_user(token: str = Depends(oauth2_scheme)) -> str:
     )
     try:
         payload = jwt.decode(
-            token, config.JWT_SECRET_KEY, algorithms=[config.JWT_ALGORITHM]
+            token, _JWT_SIGNING_KEY, algorithms=_JWT_ALGORITHMS, options={"require": ["exp"]}
         )
         # Extract the address from the 'sub' claim
-        address: str | None = payload.get("sub")
-        if address is None:
-            logger.warning("Token payload missing 'sub' (address) claim.")
-            raise credentials_exception
-
-        # Validate payload structure (optional but good practice)
-        token_data = TokenData(sub=address)
-
-    except JWTError as e:
+        address = payload["sub"]
+    except jwt.PyJWTError as e:
         logger.warning(f"JWT Error during token decoding: {e}")
         raise credentials_exception
-    except ValidationError as e:
-         logger.warning(f"JWT payload validation error: {e}")
-         raise credentials_exception
+    except KeyError:
+        logger.warning("Token payload missing 'sub' (address) claim.")
+        raise credentials_exception
+
+    if not isinstance(address, str):
+        logger.warning("Token 'sub' (address) claim is not a string.")
+        raise credentials_exception
 
     # TODO: Could add extra checks here, e.g., check if user is active in a DB
 
+    _token_cache[token] = (address, float(payload["exp"]))
+
     # Return the address (user identifier)
-    return token_data.sub
-
-
-# --- REMOVE THE INSECURE PLACEHOLDER ---
-# async def get_current_user_address_insecure(request: Request) -> str:
-#     ... (Removed) ...
-
-# --- Dependency for authenticated user (Example) ---
-# This part would typically involve session tokens (JWT) generated after successful verify
-# For now, we'll create a placeholder dependency that expects the address in a header
-# (THIS IS NOT SECURE FOR PRODUCTION - REPLACE WITH TOKEN-BASED AUTH)
-# async def get_current_user_address_insecure(request: Request) -> str:
-#     """Placeholder dependency: Gets address from a header (INSECURE - FOR DEMO ONLY)."""
-#     user_address = request.headers.get("X-User-Address")
-#     if not user_address:
-#         raise HTTPException(
-#             status_code=status.HTTP_401_UNAUTHORIZED,
-#             detail="Not authenticated (Missing X-User-Address header - demo only)"
-#         )
-#     # TODO: Add address validation (e.g., using web3.is_address)
-#     return user_address 
\ No newline at end of file
+    return address
+
+
+# --- Dependency for Admin-Only Endpoints ---
+def require_admin_key(admin_key: str | None = Depends(admin_key_scheme)):
+    """
+    Dependency that checks the X-Admin-Key header against ADMIN_API_KEY.
+    For operator endpoints (e.g. model preloading) that don't act for a wallet user.
+    """
+    if not _S.admin_api_key:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin endpoints are disabled.")
+    if not admin_key or not hmac.compare_digest(admin_key.encode(), _S.admin_api_key.encode()):
+        logger.warning("Rejected request with missing or invalid admin key.")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid admin key.")
@@ -1,7 +1,6 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, status
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, status, BackgroundTasks
 from fastapi.responses import JSONResponse
-import tempfile
-import os
+from fastapi.concurrency import run_in_threadpool
 import logging
 
 from ..services import lighthouse_service
@@ -16,6 +15,25 @@ router = APIRouter(
 
 logger = logging.getLogger(__name__)
 
+def _register_dataset_provenance(owner_address: str, filename: str, cid: str):
+    """Registers an uploaded dataset on FVM. Runs as a background task after the upload response."""
+    try:
+        logger.info(f"Registering provenance for dataset CID {cid} from owner {owner_address}")
+        tx_hash = fvm_service.register_asset_provenance(
+            owner_address=owner_address,
+            asset_type="Dataset",
+            name=filename,
+            dataset_cid=cid,
+            model_cid=None,
+            metadata_cid=None
+        )
+        if tx_hash:
+            logger.info(f"Provenance registered successfully. Tx Hash: {tx_hash}")
+        else:
+            logger.warning(f"Provenance registration failed for dataset CID {cid}. FVM service returned None.")
+    except Exception as fvm_exc:
+        logger.error(f"Error during FVM provenance registration for dataset CID {cid}: {fvm_exc}", exc_info=True)
+
 @router.post(
     "/upload/dataset",
     response_model=UploadResponse,
@@ -24,7 +42,8 @@ logger = logging.getLogger(__name__)
         status.HTTP_401_UNAUTHORIZED: {"model": ErrorResponse}
     }
 )
-def upload_dataset(
+async def upload_dataset(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     current_user_address: str = Depends(get_current_active_user)
 ):
@@ -36,66 +55,41 @@ def upload_dataset(
     """
     logger.info(f"Authenticated user {current_user_address} uploading dataset: {file.filename}")
 
-    # Use a temporary directory for secure handling
-    with tempfile.TemporaryDirectory() as temp_dir:
-        temp_file_path = os.path.join(temp_dir, file.filename)
-        try:
-            # Save the uploaded file temporarily
-            with open(temp_file_path, "wb") as buffer:
-                buffer.write(file.file.read())
-            logger.info(f"Temporarily saved uploaded file to: {temp_file_path}")
-
-            # Upload to Lighthouse
-            cid = lighthouse_service.upload_file(temp_file_path)
-
-            if cid:
-                logger.info(f"Dataset {file.filename} uploaded successfully. Lighthouse CID: {cid}")
+    try:
+        # Upload straight from the spooled upload file, no extra copy on disk.
+        # The Lighthouse client is blocking, so it runs in the threadpool.
+        cid = await run_in_threadpool(lighthouse_service.upload_stream, file.file, file.filename)
 
-                # --- Register Provenance on FVM --- 
-                try:
-                    logger.info(f"Registering provenance for dataset CID {cid} from owner {current_user_address}")
-                    tx_hash = fvm_service.register_asset_provenance(
-                        owner_address=current_user_address,
-                        asset_type="Dataset",
-                        name=file.filename,
-                        dataset_cid=cid,
-                        model_cid=None,
-                        metadata_cid=None
-                    )
-                    if tx_hash:
-                        logger.info(f"Provenance registered successfully. Tx Hash: {tx_hash}")
-                    else:
-                        logger.warning(f"Provenance registration failed for dataset CID {cid}. FVM service returned None.")
-                except Exception as fvm_exc:
-                    logger.error(f"Error during FVM provenance registration for dataset CID {cid}: {fvm_exc}", exc_info=True)
+        if cid:
+            logger.info(f"Dataset {file.filename} uploaded successfully. Lighthouse CID: {cid}")
 
-                # --- Return Success Response --- 
-                return UploadResponse(
-                    filename=file.filename,
-                    content_type=file.content_type,
-                    cid=cid
-                )
-            else:
-                logger.error(f"Failed to upload dataset {file.filename} to Lighthouse.")
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Failed to upload file to decentralized storage."
-                )
+            # --- Register Provenance on FVM --- 
+            # The on-chain transaction can take seconds, so it runs after the
+            # response has been sent; the CID is all the client needs now.
+            background_tasks.add_task(_register_dataset_provenance, current_user_address, file.filename, cid)
 
-        except HTTPException as http_exc:
-            # Re-raise HTTPExceptions directly
-            raise http_exc
-        except Exception as e:
-            logger.error(f"Error processing dataset upload for {file.filename}: {e}", exc_info=True)
+            # --- Return Success Response --- 
+            return UploadResponse(
+                filename=file.filename,
+                content_type=file.content_type,
+                cid=cid
+            )
+        else:
+            logger.error(f"Failed to upload dataset {file.filename} to Lighthouse.")
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"An unexpected error occurred: {e}"
+                detail="Failed to upload file to decentralized storage."
             )
-        finally:
-            # Ensure temporary file is cleaned up (though TemporaryDirectory handles it)
-            if os.path.exists(temp_file_path):
-                # Optional: log cleanup if needed
-                pass
+
+    except HTTPException as http_exc:
+        # Re-raise HTTPExceptions directly
+        raise http_exc
+    except Exception as e:
+        logger.error(f"Error processing dataset upload for {file.filename}: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred: {e}"
+        )
 
 # TODO: Add endpoint for uploading models (similar structure)
 # TODO: Add endpoints for querying/listing datasets/models (will likely involve FVM interaction)
@@ -1,15 +1,27 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+import anyio
+import asyncio
+import functools
+import hashlib
 import logging
-import tempfile
+import multiprocessing
 import os
-import joblib
-import json
-import shutil
+import orjson
+import tempfile
+import threading
+import time
+import uuid
+import redis
+from cachetools import LRUCache, TTLCache
+from concurrent.futures import ProcessPoolExecutor
 from typing import Any, Dict, Tuple
 
 from ..services import lighthouse_service, ml_service, fvm_service
-from ..models.data_models import InferenceRequest, InferenceResponse, ErrorResponse
-from ..routers.auth import get_current_active_user
+from ..services.redis_service import async_redis_client
+from ..models.data_models import InferenceRequest, InferenceResponse, ErrorResponse, PreloadModelRequest, PreloadModelResponse
+from ..routers.auth import get_current_active_user, require_admin_key
+from ..metrics import time_stage
 from .. import config
 
 router = APIRouter(
@@ -19,81 +31,442 @@ router = APIRouter(
 
 logger = logging.getLogger(__name__)
 
-# Simple cache for loaded models and info (consider a more robust cache like Redis/Memcached for production)
-_model_cache = {}
-_model_info_cache = {}
+# Bounded cache of loaded (model, model_info) pairs, keyed by (model_cid, model_info_cid).
+# Least recently used entries are evicted once MODEL_CACHE_SIZE is reached (and
+# unused ones after MODEL_CACHE_TTL_SECONDS, if set), so long-running workers don't
+# keep every model they ever served. Storing the pair as one entry means a model
+# is never cached without its info. Entries preloaded by an operator are pinned:
+# they live in _pinned_models and are never evicted.
+# The caches reorder on reads, so all access goes through _model_cache_lock
+# (held only for cache operations, not downloads).
+_CacheKey = Tuple[str, str | None]
+_CacheEntry = Tuple[Any, Dict]
+_model_cache: LRUCache[_CacheKey, _CacheEntry] = (
+    TTLCache(maxsize=max(1, config.MODEL_CACHE_SIZE), ttl=config.MODEL_CACHE_TTL_SECONDS)
+    if config.MODEL_CACHE_TTL_SECONDS > 0
+    else LRUCache(maxsize=max(1, config.MODEL_CACHE_SIZE))
+)
+_pinned_models: dict[_CacheKey, _CacheEntry] = {}
+_model_cache_lock = threading.Lock()
+# In-flight loads (single-flight): concurrent cold requests for the same model
+# await one shared load task instead of each downloading it. The task runs on its
+# own, so a caller disconnecting doesn't cancel the load for the others, and a
+# failed load is reported to every waiter at once rather than retried by each.
+# Only used on the event loop.
+_model_loads: dict[_CacheKey, asyncio.Task] = {}
 
-def load_model_and_info(model_cid: str, model_info_cid: str | None) -> tuple[Any | None, Dict | None]:
-    """Loads model and model_info, using cache if available."""
-    # Check cache first
-    cached_model = _model_cache.get(model_cid)
-    cached_info = _model_info_cache.get(model_info_cid or model_cid) # Use model_cid as key if info_cid missing
+# Downloads and deserialization for cold model loads run in worker threads, at most
+# MODEL_LOAD_CONCURRENCY at a time, so a burst of cold loads can't take over the
+# shared threadpool that request handlers and cache hits rely on.
+_model_load_limiter = anyio.CapacityLimiter(max(1, config.MODEL_LOAD_CONCURRENCY))
 
-    if cached_model and cached_info:
-        logger.info(f"Using cached model and info for CID: {model_cid}")
-        return cached_model, cached_info
+async def _run_load_step(func, *args, **kwargs):
+    """Runs one blocking step of a model load in a thread, bounded by _model_load_limiter."""
+    return await anyio.to_thread.run_sync(functools.partial(func, *args, **kwargs), limiter=_model_load_limiter)
 
-    logger.info(f"Cache miss for model {model_cid}. Downloading...")
-    temp_dir = None
-    model = None
-    model_info = None
+# joblib.load holds the GIL for most of its runtime, so with MODEL_LOAD_WORKERS set
+# joblib models are deserialized in worker processes instead and concurrent cold
+# loads run in parallel. The model is pickled back to this process, so arrays
+# can't stay memory-mapped from the disk cache. Spawned rather than forked: the
+# server already runs threads. ONNX sessions can't be pickled and always load here.
+_load_pool: ProcessPoolExecutor | None = (
+    ProcessPoolExecutor(
+        max_workers=min(config.MODEL_LOAD_WORKERS, os.cpu_count() or 1),
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+    if config.MODEL_LOAD_WORKERS > 0
+    else None
+)
 
-    try:
-        temp_dir = tempfile.mkdtemp()
-        model_path = os.path.join(temp_dir, f"{model_cid}.joblib")
-        info_path = os.path.join(temp_dir, f"{model_info_cid or model_cid}.json")
+async def _deserialize_model(source: str | bytes | bytearray, model_format: str) -> Any:
+    """Deserializes a model in the process pool if enabled, otherwise in a load thread."""
+    if _load_pool is None or model_format == "onnx":
+        return await _run_load_step(ml_service.load_model, source, model_format, mmap_mode='r')
+    async with _model_load_limiter:
+        return await asyncio.get_running_loop().run_in_executor(_load_pool, ml_service.load_model, source, model_format)
 
-        # Download model
-        if not lighthouse_service.download_file(model_cid, model_path):
-            logger.error(f"Failed to download model file {model_cid}")
-            return None, None
+def shutdown_load_pool():
+    """Stops the model load worker processes, if any."""
+    if _load_pool is not None:
+        _load_pool.shutdown(wait=False, cancel_futures=True)
 
-        # Download model info (if CID provided)
-        info_cid_to_download = model_info_cid
+# Optional on-disk cache of downloaded files, named by CID. CIDs are content
+# hashes, so a cached file is always valid and survives restarts.
+if config.MODEL_CACHE_DIR:
+    os.makedirs(config.MODEL_CACHE_DIR, exist_ok=True)
+    logger.info(f"Model disk cache enabled at {config.MODEL_CACHE_DIR}")
+_disk_sweep_lock = threading.Lock()
+
+# Paths returned by _fetch_file and not yet read -> number of loads using them.
+# The sweeper skips these, so a file isn't evicted between its fetch and its
+# load (which, for a model, waits for its info too). Guarded by _disk_sweep_lock.
+_disk_cache_in_use: dict[str, int] = {}
+
+def _release_cached_file(path: str):
+    """Releases a path returned by _fetch_file, once it has been read."""
+    with _disk_sweep_lock:
+        count = _disk_cache_in_use.get(path, 0) - 1
+        if count > 0:
+            _disk_cache_in_use[path] = count
+        else:
+            _disk_cache_in_use.pop(path, None)
 
-        # --- Attempt to find metadata CID from provenance if not provided ---
-        if not info_cid_to_download:
-            logger.info(f"Model info CID not provided for model {model_cid}. Attempting to lookup via provenance...")
+def _sweep_disk_cache():
+    """
+    Evicts least recently used files from the disk cache until it fits in
+    MODEL_CACHE_DIR_MAX_BYTES. Files are ordered by access time, which
+    _fetch_file refreshes on every hit (so it works on noatime mounts too).
+    Files still waiting to be read are skipped. Removing a file that a loaded
+    model still memory-maps is safe: the mapping keeps the data alive until the
+    model is dropped.
+    """
+    max_bytes = config.MODEL_CACHE_DIR_MAX_BYTES
+    if max_bytes <= 0:
+        return
+    with _disk_sweep_lock:
+        files = []
+        with os.scandir(config.MODEL_CACHE_DIR) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False) and not entry.name.endswith(".part"):
+                    st = entry.stat(follow_symlinks=False)
+                    files.append((st.st_atime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= max_bytes:
+                break
+            if path in _disk_cache_in_use:
+                continue
             try:
-                provenance_record = fvm_service.get_provenance_by_cid(model_cid)
-                if provenance_record and provenance_record.get("metadataCid"):
-                    info_cid_to_download = provenance_record["metadataCid"]
-                    logger.info(f"Found metadata CID ({info_cid_to_download}) in provenance record for model {model_cid}.")
-                else:
-                    logger.warning(f"No metadata CID found in provenance record for model {model_cid}.")
-            except Exception as prov_err:
-                logger.error(f"Error looking up provenance for model {model_cid} to find metadata CID: {prov_err}")
-        # --- End metadata CID lookup --- 
-
-        if info_cid_to_download:
-             if not lighthouse_service.download_file(info_cid_to_download, info_path):
-                logger.warning(f"Failed to download model info file {info_cid_to_download}. Inference might fail if features not embedded.")
-             else:
-                 with open(info_path, 'r') as f:
-                    model_info = json.load(f)
+                os.unlink(path)
+                total -= size
+                logger.info(f"Evicted {path} from model disk cache ({size} bytes)")
+            except FileNotFoundError:
+                total -= size
+            except OSError as e:
+                logger.error(f"Error evicting {path} from model disk cache: {e}")
+
+def _fetch_file(cid: str, filename: str) -> str | None:
+    """
+    Returns the path of `cid` in the disk cache (MODEL_CACHE_DIR), downloading it first
+    if needed, or None if the download failed. The caller passes the path to
+    _release_cached_file once it has read the file.
+    """
+    # CIDs (v0 base58 / v1 base32) are alphanumeric; anything else could escape the cache dir
+    if not cid.isalnum():
+        logger.error(f"Refusing to fetch invalid CID: {cid!r}")
+        return None
+
+    cached_path = os.path.join(config.MODEL_CACHE_DIR, filename)
+    with _disk_sweep_lock:
+        cached = os.path.exists(cached_path)
+        if cached:
+            _disk_cache_in_use[cached_path] = _disk_cache_in_use.get(cached_path, 0) + 1
+    if cached:
+        logger.info(f"Using disk-cached file for CID {cid}: {cached_path}")
+        try:
+            now = time.time()
+            os.utime(cached_path, (now, os.stat(cached_path).st_mtime)) # Mark as recently used for the sweeper
+        except OSError:
+            pass
+        return cached_path
+
+    # Download next to the final name and rename, so readers never see a partial file
+    fd, part_path = tempfile.mkstemp(dir=config.MODEL_CACHE_DIR, suffix=".part")
+    os.close(fd)
+    try:
+        if not lighthouse_service.download_file(cid, part_path):
+            return None
+        # Marked in use as it appears, so no sweep (this one or a concurrent
+        # load's) can evict it before the caller reads it
+        with _disk_sweep_lock:
+            os.replace(part_path, cached_path)
+            _disk_cache_in_use[cached_path] = _disk_cache_in_use.get(cached_path, 0) + 1
+        _sweep_disk_cache()
+        return cached_path
+    finally:
+        try:
+            os.unlink(part_path)
+        except FileNotFoundError:
+            pass
+
+def _fetch_model(model_cid: str) -> str | bytes | bytearray | None:
+    """
+    Downloads a model file, returning its disk cache path if MODEL_CACHE_DIR is set
+    (release it with _release_cached_file after loading) and its content otherwise.
+    None if the download failed.
+    """
+    if config.MODEL_CACHE_DIR:
+        return _fetch_file(model_cid, f"{model_cid}.model")
+    # Without the disk cache the model is deserialized straight from memory,
+    # skipping a write and read back of a temporary file
+    return lighthouse_service.download_bytes(model_cid)
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+def _fetch_json(cid: str) -> Dict | None:
+    """Downloads (or reads from the disk cache) and parses a JSON file. None if the download failed."""
+    if config.MODEL_CACHE_DIR:
+        path = _fetch_file(cid, f"{cid}.json")
+        if not path:
+            return None
+        try:
+            data = _read_bytes(path)
+        finally:
+            _release_cached_file(path)
+    else:
+        data = lighthouse_service.download_bytes(cid)
+    return orjson.loads(data) if data is not None else None
+
+# --- Prediction Micro-Batching ---
+# Concurrent /predict calls for the same (model, model_info) are collected into
+# one batch and scored with a single model call (see ml_service.predict_batch_with_model).
+# The first request of a batch schedules its flush after PREDICT_BATCH_WINDOW_MS;
+# a full batch is flushed right away. Only used on the event loop.
+class _PendingBatch:
+    __slots__ = ("model", "model_info", "inputs", "futures")
+
+    def __init__(self, model: Any, model_info: Dict):
+        self.model = model
+        self.model_info = model_info
+        self.inputs: list[Dict[str, Any]] = []
+        self.futures: list[asyncio.Future] = []
+
+_pending_batches: dict[tuple[int, int], _PendingBatch] = {}
+_batch_tasks: set[asyncio.Task] = set() # Strong refs so running flushes aren't garbage collected
+
+def _start_task(coro):
+    task = asyncio.create_task(coro)
+    _batch_tasks.add(task)
+    task.add_done_callback(_batch_tasks.discard)
+
+async def _run_batch(batch: _PendingBatch):
+    try:
+        results = await run_in_threadpool(ml_service.predict_batch_with_model, batch.model, batch.model_info, batch.inputs)
+    except Exception as e:
+        logger.error(f"Batched prediction failed: {e}", exc_info=True)
+        results = [None] * len(batch.inputs)
+    for future, result in zip(batch.futures, results):
+        if not future.done(): # The request may have been cancelled meanwhile
+            future.set_result(result)
+
+async def _flush_after_window(key: tuple[int, int], batch: _PendingBatch):
+    await asyncio.sleep(max(0, config.PREDICT_BATCH_WINDOW_MS) / 1000)
+    # Skip if the batch already filled up and was flushed
+    if _pending_batches.get(key) is batch:
+        del _pending_batches[key]
+        await _run_batch(batch)
+
+async def _predict_batched(model: Any, model_info: Dict, input_data: Dict[str, Any]) -> Dict[str, Any] | None:
+    """Queues one input for batched prediction and waits for its result."""
+    # The batch holds references to both objects, so their ids stay unique while it's pending
+    key = (id(model), id(model_info))
+    batch = _pending_batches.get(key)
+    if batch is None:
+        batch = _pending_batches[key] = _PendingBatch(model, model_info)
+        _start_task(_flush_after_window(key, batch))
+
+    future = asyncio.get_running_loop().create_future()
+    batch.inputs.append(input_data)
+    batch.futures.append(future)
+    if len(batch.inputs) >= max(1, config.PREDICT_BATCH_MAX_SIZE):
+        del _pending_batches[key]
+        _start_task(_run_batch(batch))
+    return await future
+
+# Metadata CIDs found via provenance, by model CID. Registered records don't change,
+# so this saves an FVM RPC on cold loads of models requested without model_info_cid.
+# Only found CIDs are cached, so a model registered later is picked up on its next load.
+# Entries can be dropped with DELETE /inference/provenance-cache/{cid}.
+_metadata_cid_cache: TTLCache[str, str] = TTLCache(maxsize=1024, ttl=3600)
+_metadata_cid_cache_lock = threading.Lock()
+
+def _lookup_metadata_cid(model_cid: str) -> str | None:
+    """Finds a model's metadata CID from its provenance record, if one is registered."""
+    with _metadata_cid_cache_lock:
+        metadata_cid = _metadata_cid_cache.get(model_cid)
+    if metadata_cid:
+        logger.info(f"Using cached metadata CID ({metadata_cid}) for model {model_cid}.")
+        return metadata_cid
+
+    logger.info(f"Model info CID not provided for model {model_cid}. Attempting to lookup via provenance...")
+    try:
+        provenance_record = fvm_service.get_provenance_by_cid(model_cid)
+        if provenance_record and provenance_record.get("metadataCid"):
+            logger.info(f"Found metadata CID ({provenance_record['metadataCid']}) in provenance record for model {model_cid}.")
+            with _metadata_cid_cache_lock:
+                _metadata_cid_cache[model_cid] = provenance_record["metadataCid"]
+            return provenance_record["metadataCid"]
+        logger.warning(f"No metadata CID found in provenance record for model {model_cid}.")
+    except Exception as prov_err:
+        logger.error(f"Error looking up provenance for model {model_cid} to find metadata CID: {prov_err}")
+    return None
+
+def _get_cached(model_cid: str, model_info_cid: str | None, pin: bool = False) -> tuple[Any | None, Dict | None]:
+    """Returns the cached (model, model_info) pair, or Nones on a miss. Optionally pins a hit."""
+    key = (model_cid, model_info_cid)
+    with _model_cache_lock:
+        entry = _pinned_models.get(key) or _model_cache.get(key)
+        if entry and pin and key not in _pinned_models:
+            _pinned_models[key] = _model_cache.pop(key)
+    return entry or (None, None)
+
+def _store_cached(model_cid: str, model_info_cid: str | None, model: Any, model_info: Dict, pin: bool = False):
+    key = (model_cid, model_info_cid)
+    with _model_cache_lock:
+        if pin or key in _pinned_models:
+            _pinned_models[key] = (model, model_info)
         else:
-            logger.warning(f"Model info CID not provided for model {model_cid}. Required for feature validation.")
-            # Attempt to load model anyway, but it might fail later
+            _model_cache[key] = (model, model_info)
+
+async def load_model_and_info(model_cid: str, model_info_cid: str | None, pin: bool = False) -> tuple[Any | None, Dict | None]:
+    """
+    Loads model and model_info, using cache if available.
+    Concurrent misses for the same model wait for a single download.
+    With pin=True the loaded model is kept in memory regardless of cache size.
+    """
+    # Check cache first
+    with time_stage("cache_lookup", model_cid):
+        model, model_info = _get_cached(model_cid, model_info_cid, pin)
+    if model:
+        logger.info(f"Using cached model and info for CID: {model_cid}")
+        return model, model_info
 
-        # Load model from file
-        model = joblib.load(model_path)
+    key = (model_cid, model_info_cid)
+    task = _model_loads.get(key)
+    if task is None:
+        task = _model_loads[key] = asyncio.create_task(_download_model_and_info(model_cid, model_info_cid, pin))
+        task.add_done_callback(lambda done: _model_loads.pop(key) if _model_loads.get(key) is done else None)
+    else:
+        logger.info(f"Waiting for in-flight load of model CID: {model_cid}")
 
-        # Update cache
-        _model_cache[model_cid] = model
+    model, model_info = await asyncio.shield(task)
+    if pin and model and model_info:
+        _get_cached(model_cid, model_info_cid, pin=True) # The shared load may have been started unpinned
+    return model, model_info
+
+async def _download_model_and_info(model_cid: str, model_info_cid: str | None, pin: bool = False) -> tuple[Any | None, Dict | None]:
+    """Downloads and loads a model and its info, fetching both concurrently, and caches them."""
+    logger.info(f"Cache miss for model {model_cid}. Downloading...")
+
+    try:
+        async def fetch_model_info() -> Dict | None:
+            # Fall back to the provenance record if no info CID was provided
+            info_cid = model_info_cid
+            if not info_cid:
+                with time_stage("provenance_lookup", model_cid):
+                    info_cid = await _run_load_step(_lookup_metadata_cid, model_cid)
+            if not info_cid:
+                logger.warning(f"Model info CID not provided for model {model_cid}. Required for feature validation.")
+                return None
+            with time_stage("lighthouse_download", info_cid):
+                info = await _run_load_step(_fetch_json, info_cid)
+            if info is None:
+                logger.warning(f"Failed to download model info file {info_cid}. Inference might fail if features not embedded.")
+            return info
+
+        async def fetch_model() -> str | bytes | bytearray | None:
+            with time_stage("lighthouse_download", model_cid):
+                return await _run_load_step(_fetch_model, model_cid)
+
+        # The downloads are independent, so a cold miss costs max(model, info), not the sum.
+        # Exceptions are collected rather than raised, so a disk-cached model file
+        # is released below even if fetching the info failed.
+        model_source, model_info = await asyncio.gather(fetch_model(), fetch_model_info(), return_exceptions=True)
+        try:
+            for result in (model_source, model_info):
+                if isinstance(result, BaseException):
+                    raise result
+            if model_source is None:
+                logger.error(f"Failed to download model file {model_cid}")
+                return None, None
+
+            # The info says how the model file is serialized (joblib if not stated).
+            # Files in the disk cache are stable, so numpy arrays in a joblib pickle can be
+            # memory-mapped read-only: pages are loaded on demand and shared between
+            # worker processes instead of copied into each heap. This helps models that
+            # keep plain numpy attributes (e.g. LogisticRegression's coef_); sklearn trees
+            # copy their node arrays on unpickling and XGBoost stores an opaque booster,
+            # so RandomForest/XGBoost models are loaded into memory as usual.
+            model_format = (model_info or {}).get("format", "joblib")
+            with time_stage("joblib_load", model_cid):
+                model = await _deserialize_model(model_source, model_format)
+        finally:
+            # Loaded (or failed); the sweeper may evict the file again
+            if isinstance(model_source, str):
+                await run_in_threadpool(_release_cached_file, model_source)
+
+        # Cached compiled, so the feature layout is derived once per model.
+        # Without info the model can't be used for inference, so it isn't cached.
         if model_info:
-            _model_info_cache[model_info_cid or model_cid] = model_info
+            model_info = ml_service.compile_model_info(model_info)
+            _store_cached(model_cid, model_info_cid, model, model_info, pin)
 
         return model, model_info
 
     except Exception as e:
         logger.error(f"Error loading model/info for CID {model_cid}: {e}", exc_info=True)
         return None, None
+
+# --- Prediction Result Cache ---
+# Predictions are deterministic for a given model, so results are shared across
+# workers in Redis, keyed by model, info and the canonical (key-sorted) input.
+# A hit skips model loading and prediction entirely. Cache errors are logged
+# and otherwise ignored: the prediction is just computed.
+def _prediction_cache_key(model_cid: str, model_info_cid: str | None, input_data: Dict[str, Any]) -> str:
+    input_hash = hashlib.sha256(orjson.dumps(input_data, option=orjson.OPT_SORT_KEYS)).hexdigest()
+    return f"pred:{model_cid}:{model_info_cid or ''}:{input_hash}"
+
+async def _get_cached_prediction(cache_key: str) -> Dict[str, Any] | None:
+    if not async_redis_client or config.PREDICT_CACHE_TTL_SECONDS <= 0:
+        return None
+    try:
+        cached = await async_redis_client.get(cache_key)
+    except redis.RedisError as e:
+        logger.warning(f"Prediction cache lookup failed: {e}")
+        return None
+    return orjson.loads(cached) if cached else None
+
+async def _cache_prediction(cache_key: str, prediction_result: Dict[str, Any]):
+    if not async_redis_client or config.PREDICT_CACHE_TTL_SECONDS <= 0:
+        return
+    try:
+        await async_redis_client.set(cache_key, orjson.dumps(prediction_result), ex=config.PREDICT_CACHE_TTL_SECONDS)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to store prediction in cache: {e}")
+
+# --- Startup Warmup ---
+# Set once the PRELOAD_MODEL_CIDS warmup has finished (successfully or not);
+# the app's /ready probe reports not-ready until then.
+warmup_complete = False
+
+def _warmup_input(model_info: Dict) -> Dict[str, Any]:
+    """A synthetic all-zeros input matching the model's features."""
+    return {feature: 0 for feature in model_info.get("features", [])}
+
+async def warmup_models():
+    """
+    Loads and pins each model in PRELOAD_MODEL_CIDS, then runs one dummy prediction
+    so lazy imports and BLAS thread pools are initialized before the first real request.
+    Failures are logged and don't stop the remaining models or the app.
+    """
+    global warmup_complete
+    try:
+        for entry in config.PRELOAD_MODEL_CIDS:
+            model_cid, _, model_info_cid = entry.partition(":")
+            logger.info(f"Warming up model {model_cid}...")
+            model, model_info = await load_model_and_info(model_cid, model_info_cid or None, pin=True)
+            if not model or not model_info:
+                logger.error(f"Warmup failed to load model {model_cid}")
+                continue
+            result = await run_in_threadpool(ml_service.predict_with_model, model, model_info, _warmup_input(model_info))
+            if result is None:
+                logger.warning(f"Warmup prediction failed for model {model_cid}; the model stays loaded.")
+            else:
+                logger.info(f"Model {model_cid} loaded and warmed up.")
     finally:
-        if temp_dir and os.path.exists(temp_dir):
-            try:
-                shutil.rmtree(temp_dir)
-            except Exception as e:
-                logger.error(f"Error cleaning up temp dir {temp_dir} during model load: {e}")
+        warmup_complete = True
 
 @router.post(
     "/predict",
@@ -104,6 +477,7 @@ def load_model_and_info(model_cid: str, model_info_cid: str | None) -> tuple[Any
         status.HTTP_500_INTERNAL_SERVER_ERROR: {"model": ErrorResponse},
         status.HTTP_401_UNAUTHORIZED: {"model": ErrorResponse},
         status.HTTP_402_PAYMENT_REQUIRED: {"model": ErrorResponse, "description": "Payment verification failed"},
+        status.HTTP_503_SERVICE_UNAVAILABLE: {"model": ErrorResponse, "description": "Payment claims temporarily unavailable"},
     }
 )
 async def predict(
@@ -125,6 +499,30 @@ async def predict(
     """
     logger.info(f"User {current_user_address} requesting inference for model CID: {inference_request.model_cid}")
 
+    # Each payment pays for one prediction. It's claimed up front (in Redis when
+    # configured, shared with training payments and across workers) so concurrent
+    # requests can't share it, and released if the request fails. (fvm_service
+    # caches verified payments, so a retry doesn't repeat the RPC.)
+    tx_hash = inference_request.paymentTxHash
+    claim_id = f"predict:{uuid.uuid4()}"
+    claimed = await run_in_threadpool(fvm_service.claim_payment, tx_hash, claim_id)
+    if claimed is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Payment claim unavailable. Please try again later.")
+    if not claimed:
+        logger.warning(f"User {current_user_address} reused payment tx {tx_hash}")
+        raise HTTPException(status_code=status.HTTP_402_PAYMENT_REQUIRED, detail="This service fee payment has already been used.")
+    try:
+        return await _verify_payment_and_predict(inference_request, current_user_address)
+    except BaseException:
+        # Failed requests don't use up the payment, so the client can retry with it.
+        # Shielded so a cancelled request still gets its release.
+        await asyncio.shield(run_in_threadpool(fvm_service.release_payment, tx_hash, claim_id))
+        raise
+
+async def _verify_payment_and_predict(
+    inference_request: InferenceRequest,
+    current_user_address: str
+) -> InferenceResponse:
     # --- Payment Verification --- 
     # TODO: Add INFERENCE_SERVICE_FEE to config.py and .env.example
     expected_fee = config.INFERENCE_SERVICE_FEE 
@@ -133,7 +531,9 @@ async def predict(
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Service configuration error.")
 
     logger.info(f"Verifying payment transaction: {inference_request.paymentTxHash}")
-    payment_verified = fvm_service.verify_payment(
+    # RPC call (unless already verified); run in the threadpool so it doesn't block the event loop
+    payment_verified = await run_in_threadpool(
+        fvm_service.verify_payment,
         tx_hash=inference_request.paymentTxHash,
         expected_payer=current_user_address,
         expected_amount=expected_fee, 
@@ -148,8 +548,18 @@ async def predict(
     logger.info(f"Payment verified successfully for tx {inference_request.paymentTxHash}")
     # --- End Payment Verification --- 
 
+    cache_key = _prediction_cache_key(inference_request.model_cid, inference_request.model_info_cid, inference_request.input_data)
+    prediction_result = await _get_cached_prediction(cache_key)
+    if prediction_result is not None:
+        logger.info(f"Returning cached prediction for model CID: {inference_request.model_cid}")
+        return InferenceResponse(
+            prediction=prediction_result["prediction"],
+            probabilities=prediction_result["probabilities"],
+            model_cid=inference_request.model_cid
+        )
+
     # Load model and info (handles caching and downloading)
-    model, model_info = load_model_and_info(inference_request.model_cid, inference_request.model_info_cid)
+    model, model_info = await load_model_and_info(inference_request.model_cid, inference_request.model_info_cid)
 
     if not model:
         raise HTTPException(
@@ -165,11 +575,9 @@ async def predict(
         )
 
     # Perform prediction using the service
-    prediction_result = ml_service.predict_with_model(
-        model=model,
-        model_info=model_info,
-        input_data=inference_request.input_data
-    )
+    # Batched with concurrent requests for the same model; runs in the threadpool
+    with time_stage("predict", inference_request.model_cid):
+        prediction_result = await _predict_batched(model, model_info, inference_request.input_data)
 
     if prediction_result is None:
         # Error logged within the service function
@@ -178,8 +586,59 @@ async def predict(
             detail="Prediction failed. Check server logs for details."
         )
 
+    await _cache_prediction(cache_key, prediction_result)
+
     return InferenceResponse(
         prediction=prediction_result["prediction"],
         probabilities=prediction_result["probabilities"],
         model_cid=inference_request.model_cid
-    ) 
\ No newline at end of file
+    ) 
+
+@router.post(
+    "/preload",
+    response_model=PreloadModelResponse,
+    dependencies=[Depends(require_admin_key)],
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {"model": ErrorResponse},
+        status.HTTP_403_FORBIDDEN: {"model": ErrorResponse},
+        status.HTTP_404_NOT_FOUND: {"model": ErrorResponse},
+    }
+)
+async def preload_model(preload_request: PreloadModelRequest):
+    """
+    Loads a model into the inference cache and pins it, so it is never evicted
+    and its first /predict doesn't pay the download. Requires the X-Admin-Key header.
+
+    - **model_cid**: CID of the model to load.
+    - **model_info_cid** (optional): CID of the metadata file; looked up via provenance if omitted.
+    """
+    logger.info(f"Admin preload requested for model CID: {preload_request.model_cid}")
+    model, model_info = await load_model_and_info(preload_request.model_cid, preload_request.model_info_cid, pin=True)
+
+    if not model or not model_info:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Model or its metadata not found or failed to load for CID: {preload_request.model_cid}"
+        )
+
+    return PreloadModelResponse(
+        model_cid=preload_request.model_cid,
+        model_info_cid=preload_request.model_info_cid,
+        pinned=True
+    )
+
+@router.delete(
+    "/provenance-cache/{model_cid}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    dependencies=[Depends(require_admin_key)],
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {"model": ErrorResponse},
+        status.HTTP_403_FORBIDDEN: {"model": ErrorResponse},
+    }
+)
+async def invalidate_provenance_cache(model_cid: str):
+    """Drops the cached provenance lookup for a model CID. Requires the X-Admin-Key header."""
+    with _metadata_cid_cache_lock:
+        removed = _metadata_cid_cache.pop(model_cid, None)
+    fvm_service.invalidate_provenance_cache(model_cid)
+    logger.info(f"Admin invalidated provenance cache for model CID {model_cid} (cached: {removed is not None})")
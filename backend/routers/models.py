@@ -1,14 +1,14 @@
 # backend/routers/models.py
 
+import asyncio
 import logging
 import os
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from typing import Dict, Any
-import json
-import tempfile
-import shutil
+import orjson
 
-from .. import job_store
+from .. import job_store, scratch
 from ..services import lighthouse_service, fvm_service
 from ..models.data_models import (
     UploadTrainedModelRequest, 
@@ -25,58 +25,16 @@ router = APIRouter(
     responses={404: {"description": "Not found"}}
 )
 
-@router.post(
-    "/{job_id}/upload",
-    response_model=UploadTrainedModelResponse,
-    status_code=status.HTTP_200_OK,
-    summary="Upload Trained Model and Register Provenance",
-    responses={
-        status.HTTP_401_UNAUTHORIZED: {"model": ErrorResponse, "description": "Not authenticated"},
-        status.HTTP_403_FORBIDDEN: {"model": ErrorResponse, "description": "User does not own this job"},
-        status.HTTP_404_NOT_FOUND: {"model": ErrorResponse, "description": "Job not found or required files missing"},
-        status.HTTP_409_CONFLICT: {"model": ErrorResponse, "description": "Job is not in TRAINING_COMPLETE state"},
-        status.HTTP_500_INTERNAL_SERVER_ERROR: {"model": ErrorResponse, "description": "Upload or registration failed"}
-    }
-)
-async def upload_and_register_model(
-    job_id: str,
-    upload_request: UploadTrainedModelRequest,
-    current_user_address: str = Depends(get_current_active_user)
-) -> UploadTrainedModelResponse:
-    """
-    Takes a completed training job ID, uploads the generated model and info 
-    files to Lighthouse, registers provenance on FVM, and updates the job status.
+# Jobs whose upload request is between its status check and the UPLOADING_MODEL
+# write. The job store is read and written off the event loop, so a repeated
+# request could otherwise pass the check in between. Event loop only.
+_uploads_starting: set[str] = set()
 
-    Requires the job to be in the 'TRAINING_COMPLETE' state.
-    Requires JWT authentication and user must be the owner of the job.
+async def _upload_and_register(job_id: str, job: job_store.JobRecord, model_name: str | None):
+    """
+    Background task: uploads a job's model and info files to Lighthouse, registers
+    provenance on FVM, and records the outcome in the job's status.
     """
-    logger.info(f"User {current_user_address} requesting upload for job {job_id}. Payload: {upload_request.dict()}")
-
-    job = job_store.get_job(job_id)
-
-    # --- Validations ---
-    if not job:
-        logger.warning(f"Upload requested for non-existent job {job_id}")
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Training job {job_id} not found.")
-
-    if job.owner_address.lower() != current_user_address.lower():
-        logger.warning(f"User {current_user_address} attempted to upload model for job {job_id} owned by {job.owner_address}")
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User is not authorized to perform this action on the specified job.")
-
-    if job.status != "TRAINING_COMPLETE":
-        logger.warning(f"Upload requested for job {job_id} with incorrect status: {job.status}")
-        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Job {job_id} is not ready for upload. Current status: {job.status}")
-
-    if not job.temp_model_path or not job.temp_info_path:
-        logger.error(f"Job {job_id} is TRAINING_COMPLETE but missing temp file paths.")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal error: Training output file paths not found.")
-
-    if not os.path.exists(job.temp_model_path) or not os.path.exists(job.temp_info_path):
-        logger.error(f"Job {job_id}: Temporary model/info files not found at expected paths: {job.temp_model_path}, {job.temp_info_path}")
-        # This could happen if the temp dir was cleaned up prematurely or server restarted
-        job_store.update_job_status(job_id, "FAILED", message="Required temporary files for upload were missing.")
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Required files for upload not found. The job may have expired or encountered an error.")
-
     model_cid = None
     model_info_cid = None
     fvm_tx_hash = None
@@ -85,62 +43,61 @@ async def upload_and_register_model(
 
     try:
         # --- Perform Uploads and Registration ---
-        logger.info(f"Job {job_id}: Starting upload process.")
+        logger.info("Job %s: Starting upload process.", job_id)
         
-        # 1. Upload Model
-        logger.info(f"Job {job_id}: Uploading model from {job.temp_model_path}")
-        model_cid = lighthouse_service.upload_file(job.temp_model_path)
-        if not model_cid:
-            final_message = "Failed to upload trained model file."
-            logger.error(f"Job {job_id}: {final_message}")
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=final_message)
-        logger.info(f"Job {job_id}: Model uploaded successfully. CID: {model_cid}")
-
-        # 2. Upload Info
-        logger.info(f"Job {job_id}: Uploading model info from {job.temp_info_path}")
-        model_info_cid = lighthouse_service.upload_file(job.temp_info_path)
-        if not model_info_cid:
-            final_message = "Failed to upload model metadata file."
-            logger.error(f"Job {job_id}: {final_message}")
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=final_message)
-        logger.info(f"Job {job_id}: Model info uploaded successfully. CID: {model_info_cid}")
+        # 1. + 2. Upload Model and Info
+        # Both files go up in a single request (one round trip, each still gets its own CID).
+        # The chain ID / gas price RPCs for the registration step run alongside it.
+        logger.info("Job %s: Uploading model from %s and model info from %s", job_id, job.temp_model_path, job.temp_info_path)
+        cids, fee_params = await asyncio.gather(
+            run_in_threadpool(lighthouse_service.upload_files, [job.temp_model_path, job.temp_info_path]),
+            run_in_threadpool(fvm_service.get_fee_params),
+        )
+        model_cid, model_info_cid = cids or (None, None)
+        if not model_cid or not model_info_cid:
+            if not model_cid and not model_info_cid:
+                final_message = "Failed to upload trained model and metadata files."
+            elif not model_cid:
+                final_message = "Failed to upload trained model file."
+            else:
+                final_message = "Failed to upload model metadata file."
+            logger.error("Job %s: %s Model CID: %s, Info CID: %s", job_id, final_message, model_cid, model_info_cid)
+            final_status = "UPLOAD_FAILED"
+            return
+        logger.info("Job %s: Model and info uploaded successfully. Model CID: %s, Info CID: %s", job_id, model_cid, model_info_cid)
 
         # 3. Register Provenance
-        logger.info(f"Job {job_id}: Registering provenance on FVM.")
-        model_name = upload_request.model_name if upload_request.model_name else f"ML Model from Job {job_id[:8]}"
-        
-        fvm_tx_hash = fvm_service.register_asset_provenance(
+        logger.info("Job %s: Registering provenance on FVM.", job_id)
+        fvm_tx_hash = await run_in_threadpool(
+            fvm_service.register_asset_provenance,
             owner_address=job.owner_address,
             asset_type="Model",
-            name=model_name,
+            name=model_name or f"ML Model from Job {job_id[:8]}",
             dataset_cid=job.dataset_cid,
             model_cid=model_cid,
-            metadata_cid=model_info_cid
+            metadata_cid=model_info_cid,
+            fee_params=fee_params
         )
 
         if not fvm_tx_hash:
             # Log warning but consider the operation partially successful (uploads done)
             final_message = "Model and metadata uploaded, but FVM provenance registration failed."
-            logger.warning(f"Job {job_id}: {final_message}")
+            logger.warning("Job %s: %s", job_id, final_message)
             final_status = "COMPLETED" # Mark as completed, but with warning
         else:
             final_message = "Model uploaded and provenance registered successfully."
-            logger.info(f"Job {job_id}: {final_message} Tx: {fvm_tx_hash}")
+            logger.info("Job %s: %s Tx: %s", job_id, final_message, fvm_tx_hash)
             final_status = "COMPLETED"
 
-    except HTTPException as http_exc: # Catch specific upload/info failures
-        final_status = "UPLOAD_FAILED"
-        final_message = final_message or str(http_exc.detail)
-        raise http_exc # Re-raise to return the specific error
     except Exception as e:
         final_message = f"An unexpected error occurred during upload/registration: {e}"
-        logger.error(f"Job {job_id}: {final_message}", exc_info=True)
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=final_message)
+        logger.error("Job %s: %s", job_id, final_message, exc_info=True)
     finally:
         # --- Update Job Status (Final) ---
         # This runs even if exceptions occurred mid-way
-        logger.info(f"Job {job_id}: Updating final status to {final_status} with message: {final_message}")
-        job_store.update_job_status(
+        logger.info("Job %s: Updating final status to %s with message: %s", job_id, final_status, final_message)
+        await run_in_threadpool(
+            job_store.update_job_status,
             job_id,
             status=final_status,
             message=final_message,
@@ -151,34 +108,90 @@ async def upload_and_register_model(
             temp_info_path=None
         )
 
-        # --- Clean up the specific model and info files --- 
+        # --- Clean up the job's working directory (model and info files) --- 
         # This should happen regardless of success/failure of upload/registration,
-        # as long as the paths were valid at the start of the endpoint call.
-        if job and job.temp_model_path and os.path.exists(job.temp_model_path):
-            try:
-                os.remove(job.temp_model_path)
-                logger.info(f"Job {job_id}: Cleaned up temporary model file: {job.temp_model_path}")
-            except Exception as e:
-                logger.error(f"Job {job_id}: Error cleaning up model file {job.temp_model_path}: {e}")
-        
-        if job and job.temp_info_path and os.path.exists(job.temp_info_path):
-             try:
-                 os.remove(job.temp_info_path)
-                 logger.info(f"Job {job_id}: Cleaned up temporary info file: {job.temp_info_path}")
-             except Exception as e:
-                 logger.error(f"Job {job_id}: Error cleaning up info file {job.temp_info_path}: {e}")
-                 
-        # Note: The temporary directory itself might still exist if other files were created,
-        # or if the original training task failed before creating the dataset path variable.
-        # Consider a more robust cleanup strategy for the whole temp directory if needed.
-
-    # If we got here without re-raising an exception, it means COMPLETED (potentially with registration warning)
-    return UploadTrainedModelResponse(
-        model_cid=model_cid or "", # Should always have value if COMPLETED
-        model_info_cid=model_info_cid or "", # Should always have value if COMPLETED
-        fvm_tx_hash=fvm_tx_hash, # Can be None if registration failed
-        message=final_message
-    )
+        # as long as the paths were valid when the upload was accepted.
+        await run_in_threadpool(scratch.remove_job_dir, job_id)
+        logger.info("Job %s: Cleaned up working directory.", job_id)
+
+@router.post(
+    "/{job_id}/upload",
+    response_model=UploadTrainedModelResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Upload Trained Model and Register Provenance",
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {"model": ErrorResponse, "description": "Not authenticated"},
+        status.HTTP_403_FORBIDDEN: {"model": ErrorResponse, "description": "User does not own this job"},
+        status.HTTP_404_NOT_FOUND: {"model": ErrorResponse, "description": "Job not found or required files missing"},
+        status.HTTP_409_CONFLICT: {"model": ErrorResponse, "description": "Job is not in TRAINING_COMPLETE state"},
+        status.HTTP_500_INTERNAL_SERVER_ERROR: {"model": ErrorResponse, "description": "Training output paths missing"}
+    }
+)
+async def upload_and_register_model(
+    job_id: str,
+    upload_request: UploadTrainedModelRequest,
+    background_tasks: BackgroundTasks,
+    current_user_address: str = Depends(get_current_active_user)
+) -> UploadTrainedModelResponse:
+    """
+    Takes a completed training job ID and starts uploading the generated model
+    and info files to Lighthouse and registering provenance on FVM in the background.
+
+    Returns immediately with status UPLOADING_MODEL; poll GET /training/status/{job_id}
+    until it is COMPLETED (with the CIDs and tx hash) or UPLOAD_FAILED/FAILED.
+
+    Requires the job to be in the 'TRAINING_COMPLETE' state.
+    Requires JWT authentication and user must be the owner of the job.
+    """
+    logger.info("User %s requesting upload for job %s. Payload: %s", current_user_address, job_id, upload_request)
+
+    if job_id in _uploads_starting:
+        logger.warning("Upload requested for job %s while another upload request is starting", job_id)
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"An upload for job {job_id} is already starting.")
+    _uploads_starting.add(job_id)
+    try:
+        return await _start_upload(job_id, upload_request, background_tasks, current_user_address)
+    finally:
+        _uploads_starting.discard(job_id)
+
+async def _start_upload(
+    job_id: str,
+    upload_request: UploadTrainedModelRequest,
+    background_tasks: BackgroundTasks,
+    current_user_address: str
+) -> UploadTrainedModelResponse:
+    """Validates a job for upload, marks it UPLOADING_MODEL and schedules the upload."""
+    job = await run_in_threadpool(job_store.get_job, job_id)
+
+    # --- Validations ---
+    if not job:
+        logger.warning("Upload requested for non-existent job %s", job_id)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Training job {job_id} not found.")
+
+    if job.owner_address.lower() != current_user_address.lower():
+        logger.warning("User %s attempted to upload model for job %s owned by %s", current_user_address, job_id, job.owner_address)
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User is not authorized to perform this action on the specified job.")
+
+    if job.status != "TRAINING_COMPLETE":
+        logger.warning("Upload requested for job %s with incorrect status: %s", job_id, job.status)
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Job {job_id} is not ready for upload. Current status: {job.status}")
+
+    if not job.temp_model_path or not job.temp_info_path:
+        logger.error("Job %s is TRAINING_COMPLETE but missing temp file paths.", job_id)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal error: Training output file paths not found.")
+
+    if not os.path.exists(job.temp_model_path) or not os.path.exists(job.temp_info_path):
+        logger.error("Job %s: Temporary model/info files not found at expected paths: %s, %s", job_id, job.temp_model_path, job.temp_info_path)
+        # This could happen if the temp dir was cleaned up prematurely or server restarted
+        await run_in_threadpool(job_store.update_job_status, job_id, "FAILED", message="Required temporary files for upload were missing.")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Required files for upload not found. The job may have expired or encountered an error.")
+
+    # Mark the job as uploading before returning, so a repeated request gets a 409.
+    # Until this write lands, _uploads_starting turns repeats away instead.
+    await run_in_threadpool(job_store.update_job_status, job_id, "UPLOADING_MODEL", message="Uploading model and registering provenance...")
+    background_tasks.add_task(_upload_and_register, job_id, job, upload_request.model_name)
+
+    return UploadTrainedModelResponse(job_id=job_id)
 
 # --- New Endpoint to Get Model Details --- 
 @router.get(
@@ -199,16 +212,16 @@ async def get_model_details(
     Retrieves details for a given asset CID by combining on-chain provenance 
     data (like name) and off-chain metadata (like accuracy) stored on Lighthouse.
     """
-    logger.info(f"Fetching details for asset CID: {asset_cid}")
+    logger.info("Fetching details for asset CID: %s", asset_cid)
 
     # 1. Get On-Chain Provenance Record
-    provenance_record = fvm_service.get_provenance_by_cid(asset_cid)
+    provenance_record = await run_in_threadpool(fvm_service.get_provenance_by_cid, asset_cid)
 
     if not provenance_record:
-        logger.warning(f"No on-chain provenance record found for CID: {asset_cid}")
+        logger.warning("No on-chain provenance record found for CID: %s", asset_cid)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Asset provenance record not found.")
 
-    logger.debug(f"Found provenance record: {provenance_record}")
+    logger.debug("Found provenance record with fields: %s", provenance_record.keys())
     
     # Base details from provenance
     details = {
@@ -229,50 +242,42 @@ async def get_model_details(
     # 2. Get Off-Chain Metadata (if available)
     metadata_cid = provenance_record.get("metadataCid")
     if not metadata_cid:
-        logger.info(f"No metadata CID found in provenance for asset {asset_cid}. Returning on-chain details only.")
+        logger.info("No metadata CID found in provenance for asset %s. Returning on-chain details only.", asset_cid)
         return details # Return only the provenance info
     
     details["metadataCid"] = metadata_cid
-    logger.info(f"Attempting to download metadata from CID: {metadata_cid}")
+    logger.info("Attempting to download metadata from CID: %s", metadata_cid)
     
-    temp_dir = None
     try:
-        temp_dir = tempfile.mkdtemp()
-        metadata_path = os.path.join(temp_dir, f"{metadata_cid}.json")
-
-        if not lighthouse_service.download_file(metadata_cid, metadata_path):
-            logger.warning(f"Failed to download metadata file {metadata_cid} for asset {asset_cid}. Returning partial details.")
+        # Metadata files are small, so they're parsed straight from memory (no temp file)
+        metadata_bytes = await run_in_threadpool(lighthouse_service.download_bytes, metadata_cid)
+        if metadata_bytes is None:
+            logger.warning("Failed to download metadata file %s for asset %s. Returning partial details.", metadata_cid, asset_cid)
             # Don't raise 404 here, just return what we have
             return details 
 
         # Load metadata JSON
-        with open(metadata_path, 'r') as f:
-            metadata_content = json.load(f)
-            logger.debug(f"Successfully loaded metadata content: {metadata_content}")
-            
-            # Merge metadata fields into details dictionary
-            details["accuracy"] = metadata_content.get("accuracy")
-            details["target_column"] = metadata_content.get("target_column")
-            details["features"] = metadata_content.get("features")
-            details["hyperparameters_used"] = metadata_content.get("hyperparameters_used")
-            details["model_type"] = metadata_content.get("model_type") # Add model_type if present
-            # Add any other relevant fields from your model_info.json
-
-    except json.JSONDecodeError as e:
-         logger.error(f"Failed to parse downloaded metadata JSON from {metadata_cid}: {e}")
+        metadata_content = orjson.loads(metadata_bytes)
+        logger.debug("Successfully loaded metadata with fields: %s", metadata_content.keys())
+
+        # Merge metadata fields into details dictionary
+        details["accuracy"] = metadata_content.get("accuracy")
+        details["target_column"] = metadata_content.get("target_column")
+        details["features"] = metadata_content.get("features")
+        details["hyperparameters_used"] = metadata_content.get("hyperparameters_used")
+        details["model_type"] = metadata_content.get("model_type") # Add model_type if present
+        # Add any other relevant fields from your model_info.json
+
+    except orjson.JSONDecodeError as e:
+         logger.error("Failed to parse downloaded metadata JSON from %s: %s", metadata_cid, e)
          # Return partial details, maybe add an error message?
          details["metadataError"] = "Failed to parse metadata file."
          return details 
     except Exception as e:
-        logger.error(f"Error processing metadata for asset {asset_cid} (metadata CID: {metadata_cid}): {e}", exc_info=True)
+        logger.error("Error processing metadata for asset %s (metadata CID: %s): %s", asset_cid, metadata_cid, e, exc_info=True)
         # Don't raise 500, return partial info with error indicator
         details["metadataError"] = "Error processing metadata file."
         return details
-    finally:
-        # Clean up downloaded metadata file
-        if temp_dir and os.path.exists(temp_dir):
-            try: shutil.rmtree(temp_dir)
-            except Exception as e: logger.error(f"Error cleaning up metadata temp dir {temp_dir}: {e}")
 
-    logger.info(f"Successfully combined details for asset CID: {asset_cid}")
+    logger.info("Successfully combined details for asset CID: %s", asset_cid)
     return details 
\ No newline at end of file
@@ -1,4 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import ORJSONResponse
+from pydantic import TypeAdapter
 import logging
 
 from ..services import fvm_service
@@ -13,6 +15,9 @@ router = APIRouter(
 
 logger = logging.getLogger(__name__)
 
+# Validates a whole list of record dicts in one compiled pass
+_asset_records_adapter = TypeAdapter(list[AssetRecord])
+
 @router.get(
     "/cid/{cid}",
     response_model=ProvenanceResponse,
@@ -26,7 +31,7 @@ def get_provenance_record_by_cid(cid: str):
     Retrieves a single provenance asset record by its associated CID
     (dataset, model, or metadata).
     """
-    logger.info(f"Received request to get provenance for CID: {cid}")
+    logger.info("Received request to get provenance for CID: %s", cid)
     record_data = fvm_service.get_provenance_by_cid(cid)
 
     if record_data is None:
@@ -39,25 +44,21 @@ def get_provenance_record_by_cid(cid: str):
 
     # Validate and structure the response using Pydantic model
     try:
-        asset_record = AssetRecord(**record_data)
+        asset_record = AssetRecord.model_validate(record_data)
         return ProvenanceResponse(record=asset_record)
     except Exception as e:
-        logger.error(f"Failed to parse provenance data for CID {cid}: {e}", exc_info=True)
+        logger.error("Failed to parse provenance data for CID %s: %s", cid, e, exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to process provenance data from FVM."
         )
 
-@router.get(
-    "/owner/{owner_address}",
-    response_model=ProvenanceListResponse,
-    responses={status.HTTP_500_INTERNAL_SERVER_ERROR: {"model": ErrorResponse}}
-)
-def get_provenance_records_by_owner(owner_address: str):
+def _query_owner(owner_address: str) -> ORJSONResponse:
     """
-    Retrieves all provenance asset records registered by a specific owner address.
+    Fetches and validates an owner's provenance records. Shared by /owner/{owner_address} and /mine.
+    The records are validated once here and returned as a ready response, so FastAPI
+    doesn't validate and encode the (possibly long) list a second time.
     """
-    logger.info(f"Received request to get provenance for owner: {owner_address}")
     records_data = fvm_service.get_provenance_by_owner(owner_address)
 
     if records_data is None:
@@ -69,15 +70,27 @@ def get_provenance_records_by_owner(owner_address: str):
 
     # Validate and structure the response
     try:
-        validated_records = [AssetRecord(**record) for record in records_data]
-        return ProvenanceListResponse(records=validated_records)
+        validated_records = _asset_records_adapter.validate_python(records_data)
+        return ORJSONResponse({"records": _asset_records_adapter.dump_python(validated_records, mode="json")})
     except Exception as e:
-        logger.error(f"Failed to parse provenance data for owner {owner_address}: {e}", exc_info=True)
+        logger.error("Failed to parse provenance data for owner %s: %s", owner_address, e, exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to process provenance data list from FVM."
         )
 
+@router.get(
+    "/owner/{owner_address}",
+    response_model=ProvenanceListResponse,
+    responses={status.HTTP_500_INTERNAL_SERVER_ERROR: {"model": ErrorResponse}}
+)
+def get_provenance_records_by_owner(owner_address: str):
+    """
+    Retrieves all provenance asset records registered by a specific owner address.
+    """
+    logger.info("Received request to get provenance for owner: %s", owner_address)
+    return _query_owner(owner_address)
+
 @router.get(
     "/mine",
     response_model=ProvenanceListResponse,
@@ -94,6 +107,5 @@ def get_my_provenance_records(
     authenticated user (based on JWT).
     Requires authentication.
     """
-    logger.info(f"Received request to get provenance for current user: {current_user_address}")
-    # Reuse the existing function, passing the authenticated user's address
-    return get_provenance_records_by_owner(current_user_address) 
\ No newline at end of file
+    logger.info("Received request to get provenance for current user: %s", current_user_address)
+    return _query_owner(current_user_address) 
\ No newline at end of file
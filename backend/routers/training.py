@@ -1,18 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, WebSocket
+from fastapi.concurrency import run_in_threadpool
+import asyncio
+import hashlib
 import logging
-import tempfile
-import os
-import json
+import orjson
 import shutil
 import uuid # For generating job IDs
+import redis
+from cachetools import TTLCache
 from datetime import datetime, timezone # For timestamps
 from typing import Dict, Any # For job store type hint
 
-from ..services import lighthouse_service, ml_service, fvm_service
+from ..services import training_pipeline
 from ..models.data_models import TrainRequest, TrainResponse, ErrorResponse, TrainingStatusResponse
 from ..routers.auth import get_current_active_user
+from ..services.redis_service import async_redis_client
 from .. import job_store # Import the new job store module
 from .. import config # Import config to get service fee
+from ..metrics import TRAINING_QUEUE_DEPTH
 
 router = APIRouter(
     prefix="/training",
@@ -21,128 +26,101 @@ router = APIRouter(
 
 logger = logging.getLogger(__name__)
 
-def run_training_job(
-    job_id: str, 
-    dataset_cid: str,
-    owner_address: str,
-    model_type: str,
-    target_column: str,
-    hyperparameters: Dict[str, Any],
-    payment_tx_hash: str,
-    payment_nonce: str
-):
-    """Background task to verify payment, then run the training part of the pipeline."""
-    logger.info(f"Background job {job_id} started. Verifying payment {payment_tx_hash}...")
-    # --- Optional: Update status to indicate verification step --- 
-    job_store.update_job_status(job_id, "VERIFYING_PAYMENT", "Verifying service fee payment...")
-    
-    temp_dir = None # We still use a temp dir for the downloaded dataset
-    temp_model_path = None # Will hold the path to the saved model in temp_dir
-    temp_info_path = None # Will hold the path to the saved info in temp_dir
-    accuracy = None
+# Training holds a whole dataset and model in memory, so only
+# MAX_CONCURRENT_TRAINING_JOBS jobs run at once; the rest wait as QUEUED. Waiting
+# happens on the event loop, so queued jobs don't tie up threadpool threads.
+_training_slots = asyncio.Semaphore(max(1, config.MAX_CONCURRENT_TRAINING_JOBS))
 
-    try:
-        # --- 1. Payment Verification --- 
-        expected_fee = config.TRAINING_SERVICE_FEE 
-        if not expected_fee: # Check config again in background task
-             logger.error(f"Job {job_id}: Configuration error: TRAINING_SERVICE_FEE is not set.")
-             job_store.update_job_status(job_id, "FAILED", "Service configuration error.")
-             return
-
-        payment_verified = fvm_service.verify_payment(
-            tx_hash=payment_tx_hash,
-            expected_payer=owner_address, # Use owner_address passed to task
-            expected_amount=expected_fee, 
-            expected_service_type="TRAINING",
-            expected_nonce=payment_nonce
-        )
+# Jobs accepted in background mode that haven't got a training slot yet. Only
+# touched on the event loop (start_training and run_training_job), so no lock.
+_waiting_training_jobs = 0
+_USE_CELERY = config.TRAINING_QUEUE == "celery" and bool(config.REDIS_URL)
+_RETRY_AFTER_SECONDS = 30 # Suggested to clients turned away by a full queue
 
-        if not payment_verified:
-            logger.warning(f"Job {job_id}: Payment verification failed for tx {payment_tx_hash}")
-            job_store.update_job_status(job_id, "FAILED", "Service fee payment verification failed.")
-            return
-        
-        logger.info(f"Job {job_id}: Payment verified successfully.")
-        # --- End Payment Verification --- 
-
-        # Create a temporary directory for the job
-        temp_dir = tempfile.mkdtemp()
-        logger.info(f"Created temporary directory for training job {job_id}: {temp_dir}")
-
-        # 2. Download dataset into the job's temp directory
-        job_store.update_job_status(job_id, "DOWNLOADING")
-        downloaded_dataset_path = os.path.join(temp_dir, f"{dataset_cid}_dataset.csv")
-        if not lighthouse_service.download_file(dataset_cid, downloaded_dataset_path):
-            logger.error(f"Job {job_id}: Failed to download dataset {dataset_cid}")
-            job_store.update_job_status(job_id, "FAILED", "Failed to download dataset from storage.")
-            return
-
-        # 3. Train model, saving outputs into the same job temp directory
-        job_store.update_job_status(job_id, "TRAINING")
-        model, model_info, saved_model_path, saved_info_path = ml_service.train_model_on_dataset(
-            dataset_path=downloaded_dataset_path,
-            output_dir=temp_dir, # Pass the temp dir for saving model/info
-            model_type=model_type,
-            target_column=target_column,
-            hyperparameters=hyperparameters
-        )
-        if not model or not model_info or not saved_model_path or not saved_info_path:
-            logger.error(f"Job {job_id}: Model training failed for dataset {dataset_cid}")
-            job_store.update_job_status(job_id, "FAILED", "Model training process failed.")
-            return
-        
-        # Store the paths to the generated files for later upload
-        temp_model_path = saved_model_path
-        temp_info_path = saved_info_path
-        
-        # Store parameters used in metadata
-        accuracy = model_info.get('accuracy')
-        model_info['source_dataset_cid'] = dataset_cid
-        model_info['owner_address'] = owner_address
-        model_info['model_type'] = model_type
-        model_info['target_column'] = target_column
-        model_info['hyperparameters_used'] = hyperparameters
-        
-        # Update info file *in place* within the temp directory
-        with open(temp_info_path, 'w') as f:
-            json.dump(model_info, f, indent=2)
-
-        # 4. Mark Training as Complete (Upload & Registration done separately)
-        job_store.update_job_status(
-            job_id, 
-            "TRAINING_COMPLETE",
-            message="Model training finished. Ready for upload and registration.",
-            accuracy=accuracy, 
-            temp_model_path=temp_model_path, # Store the path for the next step
-            temp_info_path=temp_info_path    # Store the path for the next step
-        )
-        logger.info(f"Training job {job_id} reached TRAINING_COMPLETE status.")
+# Last depth read from the Celery queue, reported by /metrics while Redis can't be reached
+_last_celery_queue_depth = 0
 
-    except Exception as e:
-        logger.error(f"An unexpected error occurred in background training job {job_id}: {e}", exc_info=True)
+def _training_queue_depth() -> int | None:
+    """Accepted training jobs that haven't started running yet. None if the Celery queue can't be read."""
+    global _last_celery_queue_depth
+    if _USE_CELERY:
+        from ..celery_app import queue_depth
+        depth = queue_depth()
+        if depth is not None:
+            _last_celery_queue_depth = depth
+        return depth
+    return _waiting_training_jobs
 
-        # Ensure status is FAILED if an exception occurs
-        job_store.update_job_status(job_id, "FAILED", message=f"An unexpected error occurred during training: {e}")
+def _reported_training_queue_depth() -> int:
+    """TRAINING_QUEUE_DEPTH's value. A failed read must not fail the whole /metrics scrape."""
+    depth = _training_queue_depth()
+    return _last_celery_queue_depth if depth is None else depth
 
-        # If an error occurred *after* model files were saved, we might still have the paths
-        # But the job failed, so maybe clear them or leave them for debugging?
-        # For now, let's leave them if they exist, but the status is FAILED.
+TRAINING_QUEUE_DEPTH.set_function(_reported_training_queue_depth)
 
+async def run_training_job(job_id: str, **job_args):
+    """Background task: waits for a free training slot, then runs the job in the threadpool."""
+    global _waiting_training_jobs
+    try:
+        if _training_slots.locked():
+            logger.info("Training job %s queued: %s jobs already running.", job_id, config.MAX_CONCURRENT_TRAINING_JOBS)
+            await run_in_threadpool(job_store.update_job_status, job_id, "QUEUED", "Waiting for other training jobs to finish...")
+        await _training_slots.acquire()
+    finally:
+        _waiting_training_jobs -= 1
+    try:
+        await run_in_threadpool(training_pipeline.run_training_job, job_id, **job_args)
     finally:
-        # --- Selective Cleanup --- 
-        # Only clean up the downloaded dataset file.
-        # Leave the generated model and info files for the upload step.
-        # The upload endpoint will be responsible for cleaning up those files.
-        downloaded_dataset_path = os.path.join(temp_dir, f"{dataset_cid}_dataset.csv") if temp_dir and dataset_cid else None
-        if downloaded_dataset_path and os.path.exists(downloaded_dataset_path):
-            try: 
-                os.remove(downloaded_dataset_path)
-                logger.info(f"Job {job_id}: Cleaned up downloaded dataset file: {downloaded_dataset_path}")
-            except Exception as e: 
-                logger.error(f"Job {job_id}: Error cleaning up downloaded dataset file {downloaded_dataset_path}: {e}")
-        
-        # Note: The temporary directory itself (temp_dir) might remain with model/info files.
-        # Consider a separate cleanup mechanism for old/orphaned job directories if necessary.
+        _training_slots.release()
+
+# --- Duplicate Request Detection ---
+# A repeated, identical training request (same user, dataset, model, parameters and
+# payment), e.g. a client retrying a POST, gets the job it already started instead
+# of a second job downloading and training the same thing. Requests are keyed by a
+# hash of their canonical JSON, in Redis when configured so all workers share it.
+# A request whose job failed can be submitted again.
+_DUPLICATE_REQUEST_WINDOW_SECONDS = 3600
+_REDIS_TRAIN_REQUEST_PREFIX = "trainreq:"
+_recent_training_requests: TTLCache[str, str] = TTLCache(maxsize=4096, ttl=_DUPLICATE_REQUEST_WINDOW_SECONDS) # Event loop only
+
+def _training_request_key(train_request: TrainRequest, owner_address: str) -> str:
+    payload = {**train_request.model_dump(), "owner": owner_address.lower()}
+    return hashlib.sha256(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+async def _claim_training_request(request_key: str, job_id: str) -> str | None:
+    """
+    Records job_id as the job for a request. Returns the ID of an earlier job for the
+    same request instead, if it's still known and hasn't failed. job_id must already
+    be in the job store: a concurrent duplicate that finds it here looks it up, and
+    would take a missing job for an expired one and start a second job.
+    """
+    if async_redis_client:
+        redis_key = f"{_REDIS_TRAIN_REQUEST_PREFIX}{request_key}"
+        try:
+            if await async_redis_client.set(redis_key, job_id, nx=True, ex=_DUPLICATE_REQUEST_WINDOW_SECONDS):
+                return None
+            existing_id = await async_redis_client.get(redis_key)
+        except redis.RedisError as e:
+            logger.warning("Duplicate training request check failed: %s", e)
+            return None
+        existing_id = existing_id.decode() if existing_id else None
+    else:
+        existing_id = _recent_training_requests.get(request_key)
+
+    if existing_id:
+        existing_job = await run_in_threadpool(job_store.get_job, existing_id)
+        if existing_job and existing_job.status != "FAILED":
+            return existing_id
+
+    # New request, or the earlier job failed or expired: this job takes over the key
+    if async_redis_client:
+        try:
+            await async_redis_client.set(redis_key, job_id, ex=_DUPLICATE_REQUEST_WINDOW_SECONDS)
+        except redis.RedisError as e:
+            logger.warning("Failed to record training request: %s", e)
+    else:
+        _recent_training_requests[request_key] = job_id
+    return None
 
 @router.post(
     "/start",
@@ -153,6 +131,8 @@ def run_training_job(
         status.HTTP_404_NOT_FOUND: {"model": ErrorResponse},
         status.HTTP_500_INTERNAL_SERVER_ERROR: {"model": ErrorResponse},
         status.HTTP_402_PAYMENT_REQUIRED: {"model": ErrorResponse, "description": "Payment verification failed"},
+        status.HTTP_429_TOO_MANY_REQUESTS: {"model": ErrorResponse, "description": "Too many training jobs waiting"},
+        status.HTTP_503_SERVICE_UNAVAILABLE: {"model": ErrorResponse, "description": "Training queue unavailable"},
     }
 )
 async def start_training(
@@ -173,14 +153,21 @@ async def start_training(
     - **paymentTxHash**: Transaction hash of the service fee payment.
     - **paymentNonce**: Unique nonce associated with the payment transaction.
     """
-    logger.info(f"User {current_user_address} requesting training. Payload: {train_request.dict()}")
+    global _waiting_training_jobs
+    logger.info("User %s requesting training. Payload: %s", current_user_address, train_request)
+
+    # Checked here rather than in the job, so a misconfigured fee never accepts a job
+    if config.TRAINING_SERVICE_FEE <= 0:
+        logger.error("Configuration error: TRAINING_SERVICE_FEE is not set.")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Service configuration error.")
 
     # Generate a unique Job ID
     job_id = str(uuid.uuid4())
 
-    # Store initial job status
+    # Store initial job status. Stored before the request is claimed below, so a
+    # concurrent duplicate always finds this job rather than starting another.
     now = datetime.now(timezone.utc)
-    initial_status = TrainingStatusResponse(
+    initial_status = job_store.JobRecord(
         job_id=job_id,
         status="PENDING",
         dataset_cid=train_request.dataset_cid,
@@ -188,13 +175,46 @@ async def start_training(
         created_at=now,
         updated_at=now
     )
-    job_store.store_job(initial_status)
-    logger.info(f"Created training job {job_id} with PENDING status.")
+    await run_in_threadpool(job_store.store_job, initial_status)
 
-    # Add the training job to background tasks, passing the new parameters
-    background_tasks.add_task(
-        run_training_job,
-        job_id=job_id,
+    # Duplicates are answered before the backpressure check: returning a job that
+    # already exists adds nothing to the queue
+    request_key = _training_request_key(train_request, current_user_address)
+    existing_job_id = await _claim_training_request(request_key, job_id)
+    if existing_job_id:
+        await run_in_threadpool(job_store.delete_job, job_id)
+        logger.info("Duplicate training request from %s; returning existing job %s.", current_user_address, existing_job_id)
+        return TrainResponse(
+            job_id=existing_job_id,
+            message="An identical training job was already started. Check its status.",
+            dataset_cid=train_request.dataset_cid
+        )
+
+    # Backpressure: turn the request away up front rather than accept a job that
+    # would sit behind MAX_PENDING_TRAINING_JOBS others for a long time. The job is
+    # marked failed rather than deleted: a concurrent duplicate may already have
+    # been given its ID, and a failed job lets the same request be submitted again.
+    if config.MAX_PENDING_TRAINING_JOBS > 0:
+        depth = await run_in_threadpool(_training_queue_depth) if _USE_CELERY else _waiting_training_jobs
+        if depth is None:
+            # The queue lives in the same Redis, so the job couldn't be queued either
+            await run_in_threadpool(job_store.update_job_status, job_id, "FAILED", "The training queue is unavailable. Please try again later.")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="The training queue is unavailable. Please try again later.",
+                headers={"Retry-After": str(_RETRY_AFTER_SECONDS)},
+            )
+        if depth >= config.MAX_PENDING_TRAINING_JOBS:
+            logger.warning("Rejecting training request from %s: %s jobs already waiting.", current_user_address, depth)
+            await run_in_threadpool(job_store.update_job_status, job_id, "FAILED", "Too many training jobs were waiting to run. Please try again later.")
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many training jobs are waiting to run. Please try again later.",
+                headers={"Retry-After": str(_RETRY_AFTER_SECONDS)},
+            )
+    logger.info("Created training job %s with PENDING status.", job_id)
+
+    job_args = dict(
         dataset_cid=train_request.dataset_cid,
         owner_address=current_user_address,
         model_type=train_request.model_type,
@@ -204,6 +224,14 @@ async def start_training(
         payment_tx_hash=train_request.paymentTxHash,
         payment_nonce=train_request.paymentNonce
     )
+    if _USE_CELERY:
+        # Queue the job for a Celery worker; the task ID is the job ID
+        from ..celery_app import run_training_job_task
+        await run_in_threadpool(run_training_job_task.apply_async, kwargs={"job_id": job_id, **job_args}, task_id=job_id)
+    else:
+        # Add the training job to background tasks, passing the new parameters
+        _waiting_training_jobs += 1
+        background_tasks.add_task(run_training_job, job_id=job_id, **job_args)
 
     # Return job ID in the initial response
     return TrainResponse(
@@ -224,15 +252,55 @@ async def get_training_status(
     current_user_address: str = Depends(get_current_active_user) # Secure the endpoint
 ):
     """Retrieves the status and results of a specific training job."""
-    logger.info(f"User {current_user_address} requesting status for job_id: {job_id}")
-    job_status = job_store.get_job(job_id)
+    logger.info("User %s requesting status for job_id: %s", current_user_address, job_id)
+    job_status = await run_in_threadpool(job_store.get_job, job_id)
 
     if not job_status:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Training job with ID {job_id} not found.")
 
     # Authorization check: Ensure the requesting user owns the job
     if job_status.owner_address != current_user_address:
-        logger.warning(f"User {current_user_address} attempted to access job {job_id} owned by {job_status.owner_address}")
+        logger.warning("User %s attempted to access job %s owned by %s", current_user_address, job_id, job_status.owner_address)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authorized to view this training job status.")
 
-    return job_status 
\ No newline at end of file
+    return job_store.to_status_response(job_status)
+
+# Statuses after which a job doesn't change until the user acts (upload) or ever again
+_SETTLED_JOB_STATUSES = frozenset({"TRAINING_COMPLETE", "COMPLETED", "FAILED", "UPLOAD_FAILED"})
+
+@router.websocket("/ws/status/{job_id}")
+async def watch_training_status(websocket: WebSocket, job_id: str, token: str):
+    """
+    Pushes a training job's status (as returned by /status/{job_id}) now and on every
+    change, instead of the client polling. Closes once the job is settled: complete,
+    failed, or waiting for upload. Browsers can't set headers on WebSockets, so the
+    JWT is passed as the `token` query parameter. Closes with 1008 if the token is
+    invalid or the job isn't the user's.
+    """
+    try:
+        current_user_address = await get_current_active_user(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    job = await run_in_threadpool(job_store.get_job, job_id)
+    if not job or job.owner_address != current_user_address:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+
+    async def send_updates():
+        async for job in job_store.watch_job(job_id):
+            await websocket.send_text(job_store.to_status_response(job).model_dump_json())
+            if job.status in _SETTLED_JOB_STATUSES:
+                return
+
+    # Clients don't send anything, so any receive means the client has gone away.
+    # Waiting on it too stops the watch then, rather than at the next status change.
+    sender = asyncio.create_task(send_updates())
+    receiver = asyncio.create_task(websocket.receive())
+    done, pending = await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    if sender in done:
+        sender.result() # Re-raise errors from the watch
+        await websocket.close()
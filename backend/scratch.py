@@ -0,0 +1,56 @@
+# backend/scratch.py
+
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from . import config, job_store
+
+logger = logging.getLogger(__name__)
+
+# --- Job Working Directories ---
+# A training job's files (dataset, trained model and info) live in
+# <SCRATCH_DIR>/decen_ai_jobs/<job_id> until the model is uploaded, which removes
+# the directory. Every process (including Celery workers) uses the same root, so
+# reap_job_dirs can find directories of jobs whose model is never uploaded.
+_JOBS_ROOT = os.path.join(config.SCRATCH_DIR or tempfile.gettempdir(), "decen_ai_jobs")
+# Statuses of jobs that are still using their directory, whatever its age
+_ACTIVE_JOB_STATUSES = frozenset({"PENDING", "QUEUED", "VERIFYING_PAYMENT", "DOWNLOADING", "TRAINING", "UPLOADING_MODEL"})
+
+def job_dir(job_id: str) -> str:
+    """Creates (if needed) and returns a training job's working directory."""
+    path = os.path.join(_JOBS_ROOT, job_id)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def remove_job_dir(job_id: str):
+    """Deletes a training job's working directory and everything in it."""
+    shutil.rmtree(os.path.join(_JOBS_ROOT, job_id), ignore_errors=True)
+
+def reap_job_dirs() -> int:
+    """
+    Deletes working directories untouched for JOB_DIR_RETENTION_SECONDS whose job
+    is no longer running: failed jobs, models never uploaded, and jobs whose record
+    has expired. Returns the number of directories removed.
+    """
+    cutoff = time.time() - config.JOB_DIR_RETENTION_SECONDS
+    removed = 0
+    try:
+        entries = list(os.scandir(_JOBS_ROOT))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if not entry.is_dir(follow_symlinks=False) or entry.stat(follow_symlinks=False).st_mtime > cutoff:
+                continue
+        except FileNotFoundError:
+            continue
+        job = job_store.get_job(entry.name)
+        if job and job.status in _ACTIVE_JOB_STATUSES:
+            continue
+        shutil.rmtree(entry.path, ignore_errors=True)
+        removed += 1
+        logger.info(f"Reaped working directory of job {entry.name} (status: {job.status if job else 'expired'})")
+    return removed
@@ -0,0 +1,138 @@
+# backend/services/dataset_cache.py
+
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from . import lighthouse_service
+from .. import config
+
+logger = logging.getLogger(__name__)
+
+# --- Dataset Disk Cache (DATASET_CACHE_DIR) ---
+# Training datasets downloaded from Lighthouse, named by CID. CIDs are content
+# hashes, so a cached file is always valid: repeat training jobs on the same
+# dataset (another model type, another user) skip the download entirely.
+# Training only reads the file, so jobs use it in place.
+if config.DATASET_CACHE_DIR:
+    os.makedirs(config.DATASET_CACHE_DIR, exist_ok=True)
+    logger.info(f"Dataset disk cache enabled at {config.DATASET_CACHE_DIR}")
+
+# One lock per CID being fetched, so concurrent jobs on the same dataset download
+# it once; the others wait and then use the cached file. Each lock is counted by
+# the callers holding or waiting on it, and dropped only when the last one is done:
+# dropping it earlier would hand a later caller a fresh lock, and a second download.
+_fetch_locks: dict[str, threading.Lock] = {}
+_fetch_lock_users: dict[str, int] = {}
+_fetch_locks_lock = threading.Lock()
+_sweep_lock = threading.Lock()
+
+# Paths handed out by get_or_fetch and not yet released -> number of jobs using
+# them. A job opens its dataset some time after getting the path (possibly in a
+# training worker process), so the sweeper must not evict it in between. Guarded by _sweep_lock, so a sweep never sees a half-pinned path.
+_pinned: dict[str, int] = {}
+
+def _pin(path: str):
+    """Marks a cached dataset as in use. Caller holds _sweep_lock."""
+    _pinned[path] = _pinned.get(path, 0) + 1
+
+def release(path: str):
+    """Releases a path returned by get_or_fetch, once the job is done with the file."""
+    with _sweep_lock:
+        count = _pinned.get(path, 0) - 1
+        if count > 0:
+            _pinned[path] = count
+        else:
+            _pinned.pop(path, None)
+
+def _sweep():
+    """
+    Evicts least recently used datasets until the cache fits in DATASET_CACHE_DIR_MAX_BYTES.
+    Datasets pinned by running jobs still count towards the size but are never evicted.
+    """
+    max_bytes = config.DATASET_CACHE_DIR_MAX_BYTES
+    if max_bytes <= 0:
+        return
+    with _sweep_lock:
+        files = []
+        with os.scandir(config.DATASET_CACHE_DIR) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False) and not entry.name.endswith(".part"):
+                    st = entry.stat(follow_symlinks=False)
+                    files.append((st.st_atime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= max_bytes:
+                break
+            if path in _pinned:
+                continue
+            try:
+                os.unlink(path)
+                logger.info(f"Evicted {path} from dataset cache ({size} bytes)")
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Error evicting {path} from dataset cache: {e}")
+                continue
+            total -= size
+
+def get_or_fetch(cid: str) -> str | None:
+    """
+    Returns the path of a dataset in the cache, downloading it first if needed,
+    or None if the download failed. The file must be treated as read-only, and
+    the path passed to release() when the job is done with it.
+    """
+    # CIDs (v0 base58 / v1 base32) are alphanumeric; anything else could escape the cache dir
+    if not cid or not cid.isalnum():
+        logger.error(f"Refusing to fetch invalid dataset CID: {cid!r}")
+        return None
+
+    cached_path = os.path.join(config.DATASET_CACHE_DIR, f"{cid}.csv")
+    with _fetch_locks_lock:
+        lock = _fetch_locks.setdefault(cid, threading.Lock())
+        _fetch_lock_users[cid] = _fetch_lock_users.get(cid, 0) + 1
+    try:
+        with lock:
+            with _sweep_lock:
+                if os.path.exists(cached_path):
+                    _pin(cached_path)
+                    cached = True
+                else:
+                    cached = False
+            if cached:
+                logger.info(f"Using cached dataset for CID {cid}: {cached_path}")
+                try:
+                    now = time.time()
+                    os.utime(cached_path, (now, os.stat(cached_path).st_mtime)) # Mark as recently used for the sweeper
+                except OSError:
+                    pass
+                return cached_path
+
+            # Download next to the final name and rename, so readers never see a partial file
+            fd, part_path = tempfile.mkstemp(dir=config.DATASET_CACHE_DIR, suffix=".part")
+            os.close(fd)
+            try:
+                if not lighthouse_service.download_file(cid, part_path):
+                    return None
+                # Pinned as it appears, so a sweep can't evict it before it's returned
+                with _sweep_lock:
+                    os.replace(part_path, cached_path)
+                    _pin(cached_path)
+                os.utime(cached_path) # Its atime is from before the download; mark it as just used
+            finally:
+                try:
+                    os.unlink(part_path)
+                except FileNotFoundError:
+                    pass
+    finally:
+        with _fetch_locks_lock:
+            users = _fetch_lock_users[cid] - 1
+            if users:
+                _fetch_lock_users[cid] = users
+            else:
+                del _fetch_lock_users[cid]
+                del _fetch_locks[cid]
+    _sweep()
+    return cached_path
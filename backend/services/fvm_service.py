@@ -3,14 +3,19 @@ from web3 import Web3
 # from web3.middleware import geth_poa_middleware
 from web3.exceptions import TransactionNotFound
 from hexbytes import HexBytes
+import hashlib
 import json
 import logging
+import threading
 import time
 import os # For path joining
-from typing import Dict, List, Any # Import typing helpers
+from typing import Callable, Dict, List, Any # Import typing helpers
+from cachetools import TTLCache
+import redis
 from datetime import datetime, timezone
 
 from .. import config
+from .redis_service import redis_client
 
 logger = logging.getLogger(__name__)
 
@@ -93,13 +98,42 @@ except Exception as e:
 
 # --- Service Functions ---
 
+_chain_id: int | None = None # Never changes for a given RPC endpoint, so fetched once
+
+# Nonces for the backend wallet are handed out locally: concurrent registrations get
+# consecutive nonces (and skip the nonce RPC) instead of all reading the same
+# transaction count. The count is re-read from the node after a failed send, e.g.
+# if another process used the wallet in between.
+_nonce_lock = threading.Lock()
+_next_nonce: int | None = None
+
+def get_fee_params() -> Dict[str, int] | None:
+    """
+    Fetches the chain ID (cached after the first call) and current gas price for a
+    transaction. Callers can fetch these while doing other work (e.g. uploads) and
+    pass them to register_asset_provenance, so they're off its critical path.
+    Returns None if they can't be fetched.
+    """
+    global _chain_id
+    if not w3:
+        logger.error("Cannot fetch fee params: Web3 client not connected.")
+        return None
+    try:
+        if _chain_id is None:
+            _chain_id = w3.eth.chain_id
+        return {'chainId': _chain_id, 'gasPrice': w3.eth.gas_price}
+    except Exception as e:
+        logger.error(f"Error fetching chain ID / gas price: {e}", exc_info=True)
+        return None
+
 def register_asset_provenance(
     owner_address: str, 
     asset_type: str, # Added asset_type argument
     name: str | None, # Added name argument
     dataset_cid: str | None, 
     model_cid: str | None, 
-    metadata_cid: str | None
+    metadata_cid: str | None,
+    fee_params: Dict[str, int] | None = None # From get_fee_params; fetched here if not given
 ) -> str | None:
     """Registers asset provenance on the FVM contract by sending a transaction."""
     logger.info(f"Attempting to register provenance: Owner={owner_address}, Type={asset_type}, Name={name}, Dataset={dataset_cid}, Model={model_cid}, Metadata={metadata_cid}")
@@ -142,34 +176,49 @@ def register_asset_provenance(
         # Ensure owner address is checksummed
         checksum_owner_address = Web3.to_checksum_address(owner_address)
 
-        # 1. Get the correct nonce
-        nonce = w3.eth.get_transaction_count(account.address)
-        logger.info(f"Using nonce {nonce} for transaction from {account.address}")
-
-        # 2. Build the transaction with the CORRECT 7 arguments for ProvenanceLedger.sol
-        tx_data = contract.functions.registerAsset(
-            checksum_owner_address, # 1. ownerAddress (address)
-            asset_type,             # 2. assetType (string)
-            name_str,               # 3. name (string) - NOW USES FILENAME
-            description_str,        # 4. description (string)
-            primary_asset_cid,      # 5. filecoinCid (string)
-            metadata_cid_str,       # 6. metadataCid (string)
-            related_cid             # 7. sourceAssetCid (string)
-        ).build_transaction({
-            'chainId': w3.eth.chain_id,
-            'gas': 100000000, 
-            'gasPrice': w3.eth.gas_price, 
-            'nonce': nonce,
-            'from': account.address # Sender is the backend wallet
-        })
-        logger.info("Transaction data built successfully using correct contract signature.")
-
-        # 3. Sign the transaction
-        signed_tx = w3.eth.account.sign_transaction(tx_data, private_key=account.key)
-        logger.info("Transaction signed successfully.")
-
-        # 4. Send raw transaction
-        tx_hash = w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+        # 1. Fee params may have been fetched earlier, alongside other work
+        fee_params = fee_params or get_fee_params()
+        if not fee_params:
+            return None
+
+        # Steps 2-4 run under the nonce lock, so transactions are sent in nonce order.
+        # The receipt is waited for outside it.
+        global _next_nonce
+        with _nonce_lock:
+            try:
+                if _next_nonce is None:
+                    _next_nonce = w3.eth.get_transaction_count(account.address, 'pending')
+                nonce = _next_nonce
+                logger.info(f"Using nonce {nonce} for transaction from {account.address}")
+
+                # 2. Build the transaction with the CORRECT 7 arguments for ProvenanceLedger.sol
+                tx_data = contract.functions.registerAsset(
+                    checksum_owner_address, # 1. ownerAddress (address)
+                    asset_type,             # 2. assetType (string)
+                    name_str,               # 3. name (string) - NOW USES FILENAME
+                    description_str,        # 4. description (string)
+                    primary_asset_cid,      # 5. filecoinCid (string)
+                    metadata_cid_str,       # 6. metadataCid (string)
+                    related_cid             # 7. sourceAssetCid (string)
+                ).build_transaction({
+                    'chainId': fee_params['chainId'],
+                    'gas': 100000000, 
+                    'gasPrice': fee_params['gasPrice'], 
+                    'nonce': nonce,
+                    'from': account.address # Sender is the backend wallet
+                })
+                logger.info("Transaction data built successfully using correct contract signature.")
+
+                # 3. Sign the transaction
+                signed_tx = w3.eth.account.sign_transaction(tx_data, private_key=account.key)
+                logger.info("Transaction signed successfully.")
+
+                # 4. Send raw transaction
+                tx_hash = w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+                _next_nonce = nonce + 1
+            except Exception:
+                _next_nonce = None # Unknown whether the nonce was used; re-read it next time
+                raise
         tx_hash_hex = tx_hash.hex()
         logger.info(f"Transaction sent! Hash: {tx_hash_hex}")
 
@@ -179,6 +228,9 @@ def register_asset_provenance(
 
         if tx_receipt.status == 1:
             logger.info(f"Transaction successful! Receipt: {tx_receipt}")
+            # The owner's cached record list no longer includes everything
+            with _provenance_cache_lock:
+                _provenance_by_owner_cache.pop(owner_address.lower(), None)
             return tx_hash_hex
         else:
             logger.error(f"Transaction failed! Receipt: {tx_receipt}")
@@ -199,6 +251,85 @@ def register_asset_provenance(
         return None
 
 # --- Function to verify service payment via event logs ---
+# --- Verified Payment Cache ---
+# A mined payment's receipt never changes, so once a payment checks out against a
+# given set of expectations the result is remembered (in Redis when configured, so
+# all workers and Celery workers share it) and retries skip the RPC. Failures aren't
+# cached: the transaction may just not be mined yet. Keys cover every expected value,
+# so a cached result only ever answers the exact same question.
+_VERIFIED_PAYMENT_TTL_SECONDS = 86400
+_REDIS_VERIFIED_PAYMENT_PREFIX = "payverified:"
+_verified_payments: TTLCache[str, bool] = TTLCache(maxsize=10_000, ttl=_VERIFIED_PAYMENT_TTL_SECONDS)
+_verified_payments_lock = threading.Lock()
+
+def _verified_payment_key(tx_hash: str, payer: str, amount: int, service_type: str, nonce: str) -> str:
+    payment = f"{tx_hash.lower()}|{payer.lower()}|{amount}|{service_type}|{nonce}"
+    return hashlib.sha256(payment.encode()).hexdigest()
+
+def _is_payment_verified(key: str) -> bool:
+    if redis_client:
+        try:
+            return bool(redis_client.exists(f"{_REDIS_VERIFIED_PAYMENT_PREFIX}{key}"))
+        except redis.RedisError as e:
+            logger.warning(f"Verified payment cache lookup failed: {e}")
+            return False
+    with _verified_payments_lock:
+        return key in _verified_payments
+
+def _remember_verified_payment(key: str):
+    if redis_client:
+        try:
+            redis_client.set(f"{_REDIS_VERIFIED_PAYMENT_PREFIX}{key}", "1", ex=_VERIFIED_PAYMENT_TTL_SECONDS)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to cache verified payment: {e}")
+        return
+    with _verified_payments_lock:
+        _verified_payments[key] = True
+
+# --- Used Payments ---
+# Each payment pays for one training job or one prediction. The job (or prediction
+# request) claims its payment transaction before any RPC, so a replayed payment is
+# rejected without touching the chain. Training and inference share one namespace,
+# keyed by tx hash alone, so a payment can't be spent once in each. Claims record
+# the claimant's ID, so the same job (e.g. redelivered to a Celery worker) can claim
+# it again. They're released if the job fails, so the user can retry with the
+# payment. On-chain payments never expire, so neither do claims.
+_REDIS_USED_PAYMENT_PREFIX = "usedpayment:"
+_used_payments: dict[str, str] = {}
+_used_payments_lock = threading.Lock()
+
+def claim_payment(tx_hash: str, claim_id: str) -> bool | None:
+    """
+    Claims a payment for a job or request. False if someone else has already claimed it,
+    None if Redis can't be reached. Claims aren't made in memory instead then: other
+    workers couldn't see them, so the payment could be spent once per worker.
+    """
+    key = tx_hash.lower()
+    if redis_client:
+        redis_key = f"{_REDIS_USED_PAYMENT_PREFIX}{key}"
+        try:
+            return bool(redis_client.set(redis_key, claim_id, nx=True)) or redis_client.get(redis_key) == claim_id
+        except redis.RedisError as e:
+            logger.error(f"Failed to claim payment {tx_hash}: {e}")
+            return None
+    with _used_payments_lock:
+        return _used_payments.setdefault(key, claim_id) == claim_id
+
+def release_payment(tx_hash: str, claim_id: str):
+    """Releases a claim on a payment, so it can be used again."""
+    key = tx_hash.lower()
+    if redis_client:
+        redis_key = f"{_REDIS_USED_PAYMENT_PREFIX}{key}"
+        try:
+            if redis_client.get(redis_key) == claim_id:
+                redis_client.delete(redis_key)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to release payment {tx_hash}: {e}")
+        return
+    with _used_payments_lock:
+        if _used_payments.get(key) == claim_id:
+            del _used_payments[key]
+
 def verify_payment(
     tx_hash: str, 
     expected_payer: str, 
@@ -208,6 +339,7 @@ def verify_payment(
 ) -> bool:
     """
     Verifies a payment transaction by checking its receipt and emitted PaymentReceived event.
+    Successful verifications are cached, so repeating one doesn't hit the node.
 
     Args:
         tx_hash: The transaction hash of the payment.
@@ -219,9 +351,16 @@ def verify_payment(
     Returns:
         True if the payment is verified, False otherwise.
     """
+    cache_key = _verified_payment_key(tx_hash, expected_payer, expected_amount, expected_service_type, expected_nonce)
+    if _is_payment_verified(cache_key):
+        logger.info(f"Payment Tx {tx_hash} already verified, skipping RPC")
+        return True
+
     logger.info(f"Verifying payment for Tx: {tx_hash}, Payer: {expected_payer}, Amount: {expected_amount}, Service: {expected_service_type}, Nonce: {expected_nonce}")
 
-    if not w3 or not w3.is_connected() or not contract or not CONTRACT_ABI:
+    # No is_connected() check here: it's an RPC of its own, and a node that's down
+    # fails the receipt lookup below anyway
+    if not w3 or not contract or not CONTRACT_ABI:
         logger.error("Cannot verify payment: Web3 client or contract not initialized.")
         return False
 
@@ -299,6 +438,7 @@ def verify_payment(
             return False
             
         # If all checks pass
+        _remember_verified_payment(cache_key)
         return True
 
     except TransactionNotFound:
@@ -308,7 +448,52 @@ def verify_payment(
         logger.error(f"An unexpected error occurred during payment verification for tx {tx_hash}: {e}", exc_info=True)
         return False
 
+# --- Provenance Read Caches ---
+# Records are immutable once registered, so lookups by CID are cached for a few
+# minutes. Only found records are cached, since a CID can be registered at any time.
+# An owner's record list grows whenever they register an asset, so it's cached only
+# briefly and dropped by register_asset_provenance. Concurrent misses for the same
+# key wait on a per-key lock and share one RPC instead of all hitting the node.
+_provenance_by_cid_cache: TTLCache[str, Dict[str, Any]] = TTLCache(maxsize=10_000, ttl=300)
+_provenance_by_owner_cache: TTLCache[str, List[Dict[str, Any]]] = TTLCache(maxsize=1024, ttl=30)
+_provenance_cache_lock = threading.Lock() # Guards both caches and _provenance_key_locks
+_provenance_key_locks: dict[tuple[int, str], threading.Lock] = {}
+
+def _cached_query(cache: TTLCache, key: str, query: Callable[[str], Any]) -> Any:
+    """Returns cache[key], or runs query(key) once for all concurrent callers and caches a non-None result."""
+    lock_key = (id(cache), key)
+    with _provenance_cache_lock:
+        value = cache.get(key)
+        if value is not None:
+            return value
+        key_lock = _provenance_key_locks.setdefault(lock_key, threading.Lock())
+    with key_lock:
+        # Another caller may have fetched it while we waited
+        with _provenance_cache_lock:
+            value = cache.get(key)
+        if value is not None:
+            return value
+        value = query(key)
+        with _provenance_cache_lock:
+            if value is not None:
+                cache[key] = value
+            _provenance_key_locks.pop(lock_key, None)
+        return value
+
+def invalidate_provenance_cache(cid: str):
+    """Drops the cached provenance record for a CID."""
+    with _provenance_cache_lock:
+        _provenance_by_cid_cache.pop(cid, None)
+
 def get_provenance_by_cid(cid: str) -> Dict[str, Any] | None:
+    """Queries provenance by a specific CID from the FVM contract (cached)."""
+    return _cached_query(_provenance_by_cid_cache, cid, _query_provenance_by_cid)
+
+def get_provenance_by_owner(owner_address: str) -> List[Dict[str, Any]] | None:
+    """Queries provenance records for an owner address from contract events (cached briefly)."""
+    return _cached_query(_provenance_by_owner_cache, owner_address.lower(), _query_provenance_by_owner)
+
+def _query_provenance_by_cid(cid: str) -> Dict[str, Any] | None:
     """Queries provenance by a specific CID from the FVM contract."""
     logger.info(f"Querying provenance for CID: {cid}")
     if not w3 or not contract:
@@ -387,7 +572,7 @@ def get_provenance_by_cid(cid: str) -> Dict[str, Any] | None:
         logger.error(f"Error querying provenance by CID {cid}: {e}", exc_info=True)
         return None
 
-def get_provenance_by_owner(owner_address: str) -> List[Dict[str, Any]] | None:
+def _query_provenance_by_owner(owner_address: str) -> List[Dict[str, Any]] | None:
     """
     Queries provenance records for a specific owner address by fetching
     AssetRegistered events from the blockchain.
@@ -1,8 +1,15 @@
 import requests
 from lighthouseweb3 import Lighthouse
+from lighthouseweb3.functions.config import Config as LighthouseConfig
 from .. import config
+import json
 import logging
 import os # Import os for checking file existence
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Any, BinaryIO, Callable, Dict, Iterator
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -16,6 +23,148 @@ if not config.LIGHTHOUSE_API_KEY:
 else:
     lighthouse = Lighthouse(token=config.LIGHTHOUSE_API_KEY)
 
+# Files at least this large are fetched as LIGHTHOUSE_PARALLEL_CHUNKS concurrent
+# Range requests (if the gateway supports them) instead of one stream
+_PARALLEL_MIN_BYTES = 8 * 1024 * 1024
+_UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Read size for streamed downloads; large reads keep per-chunk overhead (Python
+# loop iterations, write syscalls) low on multi-GB datasets
+_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Attempts per upload; transient failures are retried after 1s, 2s, ...
+_UPLOAD_ATTEMPTS = 3
+
+# One session for all gateway and upload requests, so connections (and their TLS
+# handshakes) are reused across calls. The pool is sized for a few concurrent
+# downloads of LIGHTHOUSE_PARALLEL_CHUNKS ranges each.
+_session = requests.Session()
+_adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(32, config.LIGHTHOUSE_PARALLEL_CHUNKS * 4))
+_session.mount("https://", _adapter)
+_session.mount("http://", _adapter)
+
+def close_session():
+    """Closes pooled connections. Called on app shutdown."""
+    _session.close()
+
+def _cid_from_upload_result(result: Any, default_name: str) -> str | None:
+    """Extracts the CID from a Lighthouse upload API response, logging the outcome."""
+    logger.debug(f"Lighthouse upload API response: {result}")
+
+    if result and isinstance(result, dict) and 'data' in result and isinstance(result['data'], dict) and 'Hash' in result['data']:
+        cid = result['data']['Hash']
+        name = result['data'].get('Name', default_name)
+        size = result['data'].get('Size', 'N/A')
+        logger.info(f"Upload successful! CID: {cid}, Name: {name}, Size: {size}")
+        return cid
+    else:
+        logger.error(f"Lighthouse upload failed or returned unexpected format. Response: {result}")
+        return None
+
+class _MultipartBody:
+    """
+    A multipart/form-data body with one "file" field per file, read from the files
+    in 1 MiB chunks as requests sends it. Has a length when the files are seekable,
+    so requests sends a Content-Length instead of a chunked body.
+    """
+    def __init__(self, files: list[tuple[BinaryIO, str]], boundary: str):
+        # Each part after the first starts with the CRLF ending the previous file
+        self.parts = [
+            (b'\r\n' if i else b'') + (
+                f'--{boundary}\r\n'
+                f'Content-Disposition: form-data; name="file"; filename="{os.path.basename(filename)}"\r\n'
+                'Content-Type: application/octet-stream\r\n\r\n'
+            ).encode()
+            for i, (_, filename) in enumerate(files)
+        ]
+        self.fileobjs = [fileobj for fileobj, _ in files]
+        self.tail = f'\r\n--{boundary}--\r\n'.encode()
+
+    def seekable(self) -> bool:
+        return all(fileobj.seekable() for fileobj in self.fileobjs)
+
+    def __iter__(self) -> Iterator[bytes]:
+        for head, fileobj in zip(self.parts, self.fileobjs):
+            yield head
+            while chunk := fileobj.read(_UPLOAD_CHUNK_SIZE):
+                yield chunk
+        yield self.tail
+
+    def __len__(self) -> int:
+        size = sum(len(head) for head in self.parts) + len(self.tail)
+        for fileobj in self.fileobjs:
+            start = fileobj.tell()
+            size += fileobj.seek(0, os.SEEK_END) - start
+            fileobj.seek(start)
+        return size
+
+def _post_files(files: list[tuple[BinaryIO, str]]) -> list[Dict[str, Any]]:
+    """
+    Uploads file objects to the Lighthouse node in one multipart request, like the
+    SDK's upload/uploadBlob. Unlike those, the body is streamed from the files instead
+    of being read into memory (and copied again into a multipart body) first.
+    Returns the node's entry ({"Name", "Hash", "Size"}) for each uploaded item.
+    """
+    boundary = secrets.token_hex(16)
+    headers = {
+        "Authorization": f"Bearer {config.LIGHTHOUSE_API_KEY}",
+        "Encryption": "false",
+        "Mime-Type": "application/octet-stream",
+        "Content-Type": f"multipart/form-data; boundary={boundary}",
+    }
+    body = _MultipartBody(files, boundary)
+    response = _session.post(
+        LighthouseConfig.lighthouse_node + "/api/v0/add",
+        data=body if body.seekable() else iter(body),
+        headers=headers,
+        timeout=600,
+    )
+    response.raise_for_status()
+    try:
+        return [response.json()]
+    except ValueError:
+        # The node may answer with one JSON object per line (one per file)
+        return [json.loads(line) for line in response.text.split("\n") if line.strip()]
+
+def _tag_upload(cid: str | None):
+    """Tags an upload to identify uploads from this app (best effort, as in the SDK)."""
+    try:
+        _session.post(
+            LighthouseConfig.lighthouse_api + "/api/user/create_tag",
+            data={"tag": "decen-ai-platform", "cid": cid},
+            headers={"Authorization": f"Bearer {config.LIGHTHOUSE_API_KEY}"},
+            timeout=30,
+        )
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Failed to tag upload {cid}: {e}")
+
+def _post_files_with_retries(files: list[tuple[BinaryIO, str]]) -> list[Dict[str, Any]]:
+    """
+    Runs _post_files, retrying connection errors, timeouts and 5xx responses with
+    exponential backoff. Only seekable file objects are retried, since the body
+    has to be sent again from the start.
+    """
+    names = ", ".join(filename for _, filename in files)
+    starts = [fileobj.tell() if fileobj.seekable() else None for fileobj, _ in files]
+    for attempt in range(_UPLOAD_ATTEMPTS):
+        try:
+            return _post_files(files)
+        except requests.exceptions.RequestException as e:
+            response = getattr(e, "response", None)
+            client_error = response is not None and response.status_code < 500
+            if client_error or None in starts or attempt == _UPLOAD_ATTEMPTS - 1:
+                raise
+            delay = 2 ** attempt
+            logger.warning(f"Upload of {names} failed ({e}), retrying in {delay}s...")
+            time.sleep(delay)
+            for (fileobj, _), start in zip(files, starts):
+                fileobj.seek(start)
+
+def _upload(fileobj: BinaryIO, filename: str) -> Any:
+    """Uploads and tags a single file object. Returns the result in the SDK's {"data": {...}} shape."""
+    # With a single file, the last entry is the result
+    hash_data = _post_files_with_retries([(fileobj, filename)])[-1]
+    _tag_upload(hash_data.get("Hash"))
+    return {"data": hash_data}
+
 def upload_file(file_path: str) -> str | None:
     """Uploads a file to Lighthouse Storage and returns the CID."""
     if not lighthouse:
@@ -27,23 +176,124 @@ def upload_file(file_path: str) -> str | None:
 
     logger.info(f"Attempting to upload {file_path} to Lighthouse...")
     try:
-        # Use tag to identify uploads from this app
-        result = lighthouse.upload(source=file_path, tag="decen-ai-platform")
-        logger.debug(f"Lighthouse upload API response: {result}")
-
-        if result and isinstance(result, dict) and 'data' in result and isinstance(result['data'], dict) and 'Hash' in result['data']:
-            cid = result['data']['Hash']
-            name = result['data'].get('Name', os.path.basename(file_path))
-            size = result['data'].get('Size', 'N/A')
-            logger.info(f"Upload successful! CID: {cid}, Name: {name}, Size: {size}")
-            return cid
-        else:
-            logger.error(f"Lighthouse upload failed or returned unexpected format. Response: {result}")
-            return None
+        with open(file_path, 'rb') as f:
+            result = _upload(f, os.path.basename(file_path))
+        return _cid_from_upload_result(result, os.path.basename(file_path))
     except Exception as e:
         logger.error(f"Error during Lighthouse upload of {file_path}: {e}", exc_info=True)
         return None
 
+def upload_files(file_paths: list[str]) -> list[str | None] | None:
+    """
+    Uploads several files to Lighthouse Storage in a single request and returns
+    their CIDs, in order (None for a file the node didn't report). Each file gets
+    its own CID, as if uploaded separately. Returns None if the upload failed.
+    File names (without directories) must be distinct.
+    """
+    if not lighthouse:
+        logger.error("Lighthouse client not initialized. Cannot upload.")
+        return None
+    names = [os.path.basename(path) for path in file_paths]
+    if len(set(names)) != len(names):
+        logger.error(f"Cannot upload files with duplicate names in one request: {names}")
+        return None
+    for path in file_paths:
+        if not os.path.exists(path):
+            logger.error(f"File not found for upload: {path}")
+            return None
+
+    logger.info(f"Attempting to upload {', '.join(file_paths)} to Lighthouse in one request...")
+    try:
+        with ExitStack() as stack:
+            files = [(stack.enter_context(open(path, 'rb')), name) for path, name in zip(file_paths, names)]
+            entries = _post_files_with_retries(files)
+    except Exception as e:
+        logger.error(f"Error during Lighthouse upload of {', '.join(file_paths)}: {e}", exc_info=True)
+        return None
+
+    logger.debug(f"Lighthouse upload API response: {entries}")
+    cids_by_name = {entry.get("Name"): entry.get("Hash") for entry in entries if isinstance(entry, dict)}
+    cids = [cids_by_name.get(name) for name in names]
+    for name, cid in zip(names, cids):
+        if cid:
+            logger.info(f"Upload successful! CID: {cid}, Name: {name}")
+            _tag_upload(cid)
+        else:
+            logger.error(f"Lighthouse upload response has no entry for {name}. Response: {entries}")
+    return cids
+
+def upload_stream(fileobj: BinaryIO, filename: str) -> str | None:
+    """
+    Uploads the contents of an open file object to Lighthouse Storage and returns the CID.
+    Avoids writing a copy to disk first when the data is already in a file object
+    (e.g. an UploadFile). The file object is left open.
+    """
+    if not lighthouse:
+        logger.error("Lighthouse client not initialized. Cannot upload.")
+        return None
+
+    logger.info(f"Attempting to upload stream {filename} to Lighthouse...")
+    try:
+        result = _upload(fileobj, filename)
+        return _cid_from_upload_result(result, filename)
+    except Exception as e:
+        logger.error(f"Error during Lighthouse upload of stream {filename}: {e}", exc_info=True)
+        return None
+
+def _download_range(url: str, write_at: Callable[[int, bytes], Any], start: int, end: int):
+    """Fetches bytes [start, end] of url and hands them to write_at at their offset."""
+    with _session.get(url, headers={"Range": f"bytes={start}-{end}"}, stream=True, timeout=300) as response:
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise requests.exceptions.RequestException(f"Gateway ignored Range request (status {response.status_code})")
+        offset = start
+        for chunk in response.iter_content(chunk_size=_DOWNLOAD_CHUNK_SIZE):
+            write_at(offset, chunk)
+            offset += len(chunk)
+    if offset != end + 1:
+        raise requests.exceptions.RequestException(f"Incomplete range {start}-{end}: got {offset - start} bytes")
+
+def _download_ranges(url: str, write_at: Callable[[int, bytes], Any], size: int, parts: int):
+    """Downloads url using `parts` concurrent Range requests into preallocated storage."""
+    part_size = -(-size // parts) # Ceiling division
+    ranges = [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [executor.submit(_download_range, url, write_at, start, end) for start, end in ranges]
+        for future in futures:
+            future.result() # Re-raises the first failure
+
+def _start_download(cid: str, gateway_url: str) -> tuple[requests.Response, int]:
+    """
+    Starts a streaming GET for a CID. Returns the response and, if the file should be
+    fetched as parallel Range requests instead, its size (otherwise 0).
+    """
+    response = _session.get(gateway_url, stream=True, timeout=300) # stream=True for large files, add timeout
+    response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+
+    # Large files from a gateway that supports ranges are split across several
+    # connections; the headers tell us before any of the body is read
+    size = int(response.headers.get("Content-Length") or 0)
+    parts = config.LIGHTHOUSE_PARALLEL_CHUNKS
+    if (parts > 1 and size >= _PARALLEL_MIN_BYTES
+            and response.headers.get("Accept-Ranges") == "bytes"
+            and not response.headers.get("Content-Encoding")):
+        response.close()
+        logger.info(f"Downloading CID {cid} ({size} bytes) in {parts} parallel ranges")
+        return response, size
+    return response, 0
+
+def _log_download_error(e: Exception, cid: str, gateway_url: str):
+    if isinstance(e, requests.exceptions.HTTPError):
+        logger.error(f"HTTP Error {e.response.status_code} downloading CID {cid} from {gateway_url}: {e.response.text}")
+    elif isinstance(e, requests.exceptions.ConnectionError):
+         logger.error(f"Connection Error downloading CID {cid} from {gateway_url}: {e}", exc_info=True) # Show traceback for connection issues
+    elif isinstance(e, requests.exceptions.Timeout):
+         logger.error(f"Timeout Error downloading CID {cid} from {gateway_url}: {e}", exc_info=True)
+    elif isinstance(e, requests.exceptions.SSLError):
+         logger.error(f"SSL Error downloading CID {cid} from {gateway_url}: {e}", exc_info=True) # Show traceback for SSL issues
+    else: # Catch-all for other RequestExceptions
+        logger.error(f"Network or request error downloading CID {cid} from {gateway_url}: {type(e).__name__} - {e}", exc_info=True)
+
 def download_file(cid: str, output_path: str) -> bool:
     """Downloads a file from Lighthouse Storage gateway using its CID."""
     # Relaxed CID check: Ensure it's a non-empty string.
@@ -62,30 +312,26 @@ def download_file(cid: str, output_path: str) -> bool:
              os.makedirs(output_dir, exist_ok=True)
 
         # Make the request
-        response = requests.get(gateway_url, stream=True, timeout=300) # stream=True for large files, add timeout
-        response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+        response, parallel_size = _start_download(cid, gateway_url)
 
-        # Write the file
-        with open(output_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192): # Download in chunks
-                f.write(chunk)
+        if parallel_size:
+            fd = os.open(output_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.ftruncate(fd, parallel_size)
+                _download_ranges(gateway_url, lambda offset, chunk: os.pwrite(fd, chunk, offset), parallel_size, config.LIGHTHOUSE_PARALLEL_CHUNKS)
+            finally:
+                os.close(fd)
+        else:
+            # Write the file
+            with response, open(output_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=_DOWNLOAD_CHUNK_SIZE): # Download in chunks
+                    f.write(chunk)
 
         logger.info(f"Download successful! CID {cid} saved to {output_path}")
         return True
 
     except requests.exceptions.RequestException as e:
-        # More specific error logging
-        if isinstance(e, requests.exceptions.HTTPError):
-            # This case is already handled by response.raise_for_status(), but good to be explicit
-            logger.error(f"HTTP Error {e.response.status_code} downloading CID {cid} from {gateway_url}: {e.response.text}")
-        elif isinstance(e, requests.exceptions.ConnectionError):
-             logger.error(f"Connection Error downloading CID {cid} from {gateway_url}: {e}", exc_info=True) # Show traceback for connection issues
-        elif isinstance(e, requests.exceptions.Timeout):
-             logger.error(f"Timeout Error downloading CID {cid} from {gateway_url}: {e}", exc_info=True)
-        elif isinstance(e, requests.exceptions.SSLError):
-             logger.error(f"SSL Error downloading CID {cid} from {gateway_url}: {e}", exc_info=True) # Show traceback for SSL issues
-        else: # Catch-all for other RequestExceptions
-            logger.error(f"Network or request error downloading CID {cid} from {gateway_url}: {type(e).__name__} - {e}", exc_info=True)
+        _log_download_error(e, cid, gateway_url)
         return False
     except IOError as e:
         logger.error(f"Error writing downloaded file to {output_path}: {e}", exc_info=True)
@@ -93,3 +339,41 @@ def download_file(cid: str, output_path: str) -> bool:
     except Exception as e:
         logger.error(f"An unexpected error occurred during download of CID {cid}: {e}", exc_info=True)
         return False
+
+def download_bytes(cid: str) -> bytes | bytearray | None:
+    """
+    Downloads a file from Lighthouse Storage gateway into memory and returns its content,
+    or None on failure. For payloads that are parsed right away (JSON, models) this
+    skips writing to and reading back from a temporary file. Large files fetched in
+    parallel ranges come back as a bytearray, which callers needing bytes must convert.
+    """
+    if not cid or not isinstance(cid, str):
+        logger.error(f"Invalid or empty CID provided for download: {cid!r}")
+        return None
+
+    gateway_url = f"https://gateway.lighthouse.storage/ipfs/{cid}"
+    logger.info(f"Attempting to download CID {cid} from {gateway_url} into memory...")
+
+    try:
+        response, parallel_size = _start_download(cid, gateway_url)
+
+        if parallel_size:
+            buffer = bytearray(parallel_size)
+            view = memoryview(buffer)
+            def write_at(offset: int, chunk: bytes):
+                view[offset:offset + len(chunk)] = chunk
+            _download_ranges(gateway_url, write_at, parallel_size, config.LIGHTHOUSE_PARALLEL_CHUNKS)
+            data = buffer # Returned as-is; copying to bytes would double peak memory
+        else:
+            with response:
+                data = b"".join(response.iter_content(chunk_size=_DOWNLOAD_CHUNK_SIZE))
+
+        logger.info(f"Download successful! CID {cid} ({len(data)} bytes)")
+        return data
+
+    except requests.exceptions.RequestException as e:
+        _log_download_error(e, cid, gateway_url)
+        return None
+    except Exception as e:
+        logger.error(f"An unexpected error occurred during download of CID {cid}: {e}", exc_info=True)
+        return None
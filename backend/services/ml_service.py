@@ -1,15 +1,17 @@
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.linear_model import LogisticRegression
-import xgboost as xgb
 from sklearn.metrics import accuracy_score
 import joblib
+import io
 import os
-import json
 import logging
+import orjson
 import tempfile
-from typing import Tuple, Dict, Any, Optional
+from dataclasses import dataclass
+from typing import Tuple, Dict, Any, List, Optional
 
 logger = logging.getLogger(__name__)
 
@@ -95,6 +97,8 @@ def train_model_on_dataset(
                 model = RandomForestClassifier(**valid_rf_params)
                 logger.info(f"Initializing RandomForestClassifier with params: {valid_rf_params}")
             elif model_type == "XGBoost":
+                 # Imported here: xgboost is heavy and only needed when training this model type
+                 import xgboost as xgb
                  # XGBoost specific handling (e.g., label encoding if needed)
                  # Note: XGBoost might need target labels to be 0, 1, ...
                  # Add preprocessing here if necessary based on y_train
@@ -142,7 +146,8 @@ def train_model_on_dataset(
             "accuracy": float(accuracy),
             "training_samples": int(len(X_train)),
             "test_samples": int(len(X_test)),
-            "original_categorical_features": original_categorical_cols # Store the list
+            "original_categorical_features": original_categorical_cols, # Store the list
+            "format": "joblib" # Serialization of the model file; see load_model
         }
 
         # --- Save model and info to the specified output directory --- 
@@ -155,8 +160,8 @@ def train_model_on_dataset(
         info_path = os.path.join(output_dir, info_filename)
 
         joblib.dump(model, model_path)
-        with open(info_path, 'w') as f:
-            json.dump(model_info, f, indent=2)
+        with open(info_path, 'wb') as f:
+            f.write(orjson.dumps(model_info, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
 
         logger.info(f"Model saved to: {model_path}")
         logger.info(f"Model info saved to: {info_path}")
@@ -173,6 +178,205 @@ def train_model_on_dataset(
         logger.error(f"An error occurred during model training: {e}", exc_info=True)
         return None, None, None, None
 
+class OnnxModel:
+    """
+    Wraps an onnxruntime session with the predict/predict_proba interface of
+    the sklearn models, so the prediction code doesn't care about the format.
+    Expects a classifier exported by export_onnx (label + probability outputs).
+    """
+    def __init__(self, session: Any):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+
+    def _run(self, X: pd.DataFrame) -> List[Any]:
+        return self.session.run(None, {self.input_name: X.to_numpy(dtype=np.float32)})
+
+    def predict(self, X: pd.DataFrame) -> np.ndarray:
+        return self._run(X)[0]
+
+    def predict_proba(self, X: pd.DataFrame) -> np.ndarray:
+        return self._run(X)[1]
+
+def load_model(source: str | bytes | bytearray, model_format: str | None = "joblib", mmap_mode: str | None = None) -> Any:
+    """
+    Deserializes a model from a file path or its raw bytes.
+
+    Args:
+        source: Path to the model file, or its content (a bytearray for large
+            downloads, see lighthouse_service.download_bytes).
+        model_format: "onnx", or "joblib" (the default, also used when None).
+        mmap_mode: Passed to joblib.load for file paths (e.g. 'r').
+    """
+    if model_format == "onnx":
+        # Imported here: onnxruntime is optional and only needed for ONNX models
+        import onnxruntime
+        if isinstance(source, bytearray):
+            source = bytes(source) # InferenceSession only takes bytes or a path
+        session = onnxruntime.InferenceSession(source, providers=["CPUExecutionProvider"])
+        return OnnxModel(session)
+    if isinstance(source, (bytes, bytearray)):
+        return joblib.load(io.BytesIO(source))
+    return joblib.load(source, mmap_mode=mmap_mode)
+
+def export_onnx(model: Any, n_features: int, output_path: str) -> bool:
+    """
+    Converts a trained sklearn classifier to ONNX and saves it to output_path.
+    Returns False (and logs why) if skl2onnx isn't installed or the model
+    can't be converted, e.g. XGBoost models.
+    """
+    try:
+        # Imported here: skl2onnx is optional and only needed when exporting
+        from skl2onnx import convert_sklearn
+        from skl2onnx.common.data_types import FloatTensorType
+    except ImportError:
+        logger.warning("skl2onnx is not installed; cannot export model to ONNX.")
+        return False
+    try:
+        onnx_model = convert_sklearn(
+            model,
+            initial_types=[("input", FloatTensorType([None, n_features]))],
+            options={id(model): {"zipmap": False}}, # Plain probability array instead of a list of dicts
+        )
+        with open(output_path, 'wb') as f:
+            f.write(onnx_model.SerializeToString())
+        logger.info(f"Model exported to ONNX: {output_path}")
+        return True
+    except Exception as e:
+        logger.warning(f"Could not export {type(model).__name__} to ONNX: {e}")
+        return False
+
+@dataclass(frozen=True, slots=True)
+class FeatureSchema:
+    """Input layout of a trained model, derived once from its model_info."""
+    features: Tuple[str, ...] # Feature order AFTER encoding
+    columns: pd.Index # Same, as a ready-made DataFrame column index
+    categorical: Tuple[str, ...] # Categorical columns BEFORE encoding
+
+    @classmethod
+    def from_model_info(cls, model_info: Dict[str, Any]) -> Optional["FeatureSchema"]:
+        features = model_info.get("features")
+        if not features:
+            return None
+        return cls(
+            features=tuple(features),
+            columns=pd.Index(features),
+            categorical=tuple(model_info.get("original_categorical_features") or ()),
+        )
+
+def compile_model_info(model_info: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns a copy of model_info with its FeatureSchema precomputed under "_schema".
+    Callers that cache model_info (e.g. the inference router) store this instead,
+    so per-request preprocessing doesn't re-derive the feature layout.
+    """
+    return {**model_info, "_schema": FeatureSchema.from_model_info(model_info)}
+
+def _numeric_input_frame(input_data: Dict[str, Any], schema: FeatureSchema) -> Optional[pd.DataFrame]:
+    """
+    Builds the single-row model input straight from the trained feature order,
+    for models without categorical features. Missing features are filled with 0
+    (same as the reindex in _encoded_input_frame); keys that aren't features,
+    like identifier columns, are simply never read.
+    Returns None if a value isn't numeric, so the caller can use the general path.
+    """
+    try:
+        row = np.fromiter((input_data.get(f, 0) for f in schema.features), dtype=np.float64, count=len(schema.features))
+    except (TypeError, ValueError):
+        return None
+    return pd.DataFrame(row.reshape(1, -1), columns=schema.columns)
+
+def _encoded_input_frame(
+    input_data: Dict[str, Any],
+    expected_features_after_encoding: List[str],
+    original_categorical_features: List[str]
+) -> Optional[pd.DataFrame]:
+    """
+    Converts an input dict into a DataFrame aligned with the trained features,
+    one-hot encoding categorical columns the same way as during training.
+    Returns None if preprocessing fails.
+    """
+    # --- Convert input dict to DataFrame --- 
+    # We need a DataFrame to use get_dummies
+    input_df_original = pd.DataFrame([input_data])
+    logger.debug(f"Original input DataFrame: \n{input_df_original}")
+
+    # --- Drop identifier columns before preprocessing ---
+    identifier_cols = ['CustomerID'] # Match the columns dropped during training
+    cols_to_drop_in_input = [col for col in identifier_cols if col in input_df_original.columns]
+    if cols_to_drop_in_input:
+        input_df_original = input_df_original.drop(columns=cols_to_drop_in_input)
+        logger.info(f"Dropped identifier columns from input data: {cols_to_drop_in_input}")
+
+    # --- Apply One-Hot Encoding if needed --- 
+    input_df_processed = input_df_original.copy()
+    if original_categorical_features:
+        logger.info(f"Applying one-hot encoding to input for columns: {original_categorical_features}")
+        try:
+            # Ensure only columns present in input are encoded
+            cols_to_encode = [col for col in original_categorical_features if col in input_df_processed.columns]
+            if cols_to_encode:
+                input_df_processed = pd.get_dummies(input_df_processed, columns=cols_to_encode, drop_first=True)
+                logger.debug(f"Input DataFrame after get_dummies: \n{input_df_processed.head()}")
+                # Log dtypes after get_dummies
+                logger.debug(f"Input DataFrame dtypes after get_dummies: \n{input_df_processed.dtypes}")
+            else:
+                logger.info("No categorical columns found in the input data to encode.")
+        except Exception as e:
+            logger.error(f"Error applying get_dummies to input data: {e}", exc_info=True)
+            return None # Encoding failed
+
+    # --- Align Columns with Training Data --- 
+    # Ensure the DataFrame has exactly the columns the model expects,
+    # in the correct order, filling missing ones with 0.
+    try:
+        # Reindex based on the feature list from training
+        input_df_aligned = input_df_processed.reindex(columns=expected_features_after_encoding, fill_value=0)
+        logger.debug(f"Input DataFrame after aligning columns: \n{input_df_aligned}")
+        # Log dtypes after alignment
+        logger.debug(f"Input DataFrame dtypes after alignment: \n{input_df_aligned.dtypes}")
+    except Exception as e:
+         logger.error(f"Error aligning input columns with trained features: {e}", exc_info=True)
+         return None # Column alignment failed
+
+    # --- Validate no unexpected extra columns --- 
+    extra_cols = set(input_df_aligned.columns) - set(expected_features_after_encoding)
+    if extra_cols:
+         logger.warning(f"Input data contained unexpected columns after processing: {extra_cols}. These will be ignored.")
+         # Note: reindex should handle this, but double-checking might be useful.
+
+    return input_df_aligned
+
+def _prepare_input_frame(model_info: Dict[str, Any], input_data: Dict[str, Any]) -> Optional[pd.DataFrame]:
+    """Turns one input dict into a single-row DataFrame aligned with the model's features."""
+    # --- Get required info from metadata (precomputed if compiled) --- 
+    schema = model_info.get("_schema") or FeatureSchema.from_model_info(model_info)
+
+    if not schema:
+        logger.error("Feature list not found in model_info.")
+        return None
+
+    input_df_aligned = None
+    if not schema.categorical:
+        # All-numeric model: fill the feature vector directly, no dummies/reindex needed
+        input_df_aligned = _numeric_input_frame(input_data, schema)
+    if input_df_aligned is None:
+        input_df_aligned = _encoded_input_frame(input_data, list(schema.features), list(schema.categorical))
+    return input_df_aligned
+
+def _format_prediction(prediction: Any, proba_row: Any | None) -> Dict[str, Any]:
+    """Builds the result dict for one row from raw model outputs."""
+    probabilities = None
+    if proba_row is not None:
+        # Assuming binary classification: [prob_class_0, prob_class_1]
+        probabilities = {
+            "class_0": float(proba_row[0]),
+            "class_1": float(proba_row[1])
+        }
+    return {
+        "prediction": int(prediction), # Convert numpy int to standard int
+        "probabilities": probabilities
+    }
+
 def predict_with_model(
     model: Any,
     model_info: Dict[str, Any],
@@ -192,85 +396,68 @@ def predict_with_model(
     """
     logger.info(f"Making prediction with model type: {model_info.get('model_type', 'Unknown')}")
     try:
-        # --- Get required info from metadata --- 
-        expected_features_after_encoding = model_info.get("features") # Full feature list AFTER encoding
-        original_categorical_features = model_info.get("original_categorical_features", []) # List of categorical cols BEFORE encoding
-
-        if not expected_features_after_encoding:
-            logger.error("Feature list not found in model_info.")
-            return None
-
-        # --- Convert input dict to DataFrame --- 
-        # We need a DataFrame to use get_dummies
-        input_df_original = pd.DataFrame([input_data])
-        logger.debug(f"Original input DataFrame: \n{input_df_original}")
-
-        # --- Drop identifier columns before preprocessing ---
-        identifier_cols = ['CustomerID'] # Match the columns dropped during training
-        cols_to_drop_in_input = [col for col in identifier_cols if col in input_df_original.columns]
-        if cols_to_drop_in_input:
-            input_df_original = input_df_original.drop(columns=cols_to_drop_in_input)
-            logger.info(f"Dropped identifier columns from input data: {cols_to_drop_in_input}")
-
-        # --- Apply One-Hot Encoding if needed --- 
-        input_df_processed = input_df_original.copy()
-        if original_categorical_features:
-            logger.info(f"Applying one-hot encoding to input for columns: {original_categorical_features}")
-            try:
-                # Ensure only columns present in input are encoded
-                cols_to_encode = [col for col in original_categorical_features if col in input_df_processed.columns]
-                if cols_to_encode:
-                    input_df_processed = pd.get_dummies(input_df_processed, columns=cols_to_encode, drop_first=True)
-                    logger.debug(f"Input DataFrame after get_dummies: \n{input_df_processed.head()}")
-                    # Log dtypes after get_dummies
-                    logger.debug(f"Input DataFrame dtypes after get_dummies: \n{input_df_processed.dtypes}")
-                else:
-                    logger.info("No categorical columns found in the input data to encode.")
-            except Exception as e:
-                logger.error(f"Error applying get_dummies to input data: {e}", exc_info=True)
-                return None # Encoding failed
-
-        # --- Align Columns with Training Data --- 
-        # Ensure the DataFrame has exactly the columns the model expects,
-        # in the correct order, filling missing ones with 0.
-        try:
-            # Reindex based on the feature list from training
-            input_df_aligned = input_df_processed.reindex(columns=expected_features_after_encoding, fill_value=0)
-            logger.debug(f"Input DataFrame after aligning columns: \n{input_df_aligned}")
-            # Log dtypes after alignment
-            logger.debug(f"Input DataFrame dtypes after alignment: \n{input_df_aligned.dtypes}")
-        except Exception as e:
-             logger.error(f"Error aligning input columns with trained features: {e}", exc_info=True)
-             return None # Column alignment failed
-
-        # --- Validate no unexpected extra columns --- 
-        extra_cols = set(input_df_aligned.columns) - set(expected_features_after_encoding)
-        if extra_cols:
-             logger.warning(f"Input data contained unexpected columns after processing: {extra_cols}. These will be ignored.")
-             # Note: reindex should handle this, but double-checking might be useful.
+        input_df_aligned = _prepare_input_frame(model_info, input_data)
+        if input_df_aligned is None:
+            return None # Preprocessing failed, error already logged
 
         # Make prediction
         prediction = model.predict(input_df_aligned) # Use the fully processed DataFrame
         logger.debug(f"Raw prediction output: {prediction} (Type: {type(prediction)})")
-        prediction_value = int(prediction[0]) # Convert numpy int to standard int
 
         # Get probabilities (if available)
-        probabilities = None
-        if hasattr(model, "predict_proba"):
-            proba_raw = model.predict_proba(input_df_aligned)
-            # Assuming binary classification: [prob_class_0, prob_class_1]
-            probabilities = {
-                "class_0": float(proba_raw[0][0]),
-                "class_1": float(proba_raw[0][1])
-            }
-
-        result = {
-            "prediction": prediction_value,
-            "probabilities": probabilities
-        }
+        proba_raw = model.predict_proba(input_df_aligned) if hasattr(model, "predict_proba") else None
+
+        result = _format_prediction(prediction[0], proba_raw[0] if proba_raw is not None else None)
         logger.info(f"Prediction successful: {result}")
         return result
 
     except Exception as e:
         logger.error(f"An error occurred during prediction: {e}", exc_info=True)
-        return None 
\ No newline at end of file
+        return None
+
+def predict_batch_with_model(
+    model: Any,
+    model_info: Dict[str, Any],
+    inputs: List[Dict[str, Any]]
+) -> List[Optional[Dict[str, Any]]]:
+    """
+    Makes predictions for several inputs with one model.predict/predict_proba call.
+    Each input is preprocessed exactly as in predict_with_model; the aligned rows
+    are then stacked, so per-call model overhead is paid once per batch.
+
+    Returns one result per input, in order; None where that input failed.
+    """
+    if len(inputs) == 1:
+        return [predict_with_model(model, model_info, inputs[0])]
+
+    logger.info(f"Making batched prediction for {len(inputs)} inputs with model type: {model_info.get('model_type', 'Unknown')}")
+    results: List[Optional[Dict[str, Any]]] = [None] * len(inputs)
+    frames = []
+    positions = []
+    for i, input_data in enumerate(inputs):
+        try:
+            frame = _prepare_input_frame(model_info, input_data)
+        except Exception as e:
+            logger.error(f"An error occurred preparing batched input {i}: {e}", exc_info=True)
+            frame = None
+        if frame is not None:
+            frames.append(frame)
+            positions.append(i)
+    if not frames:
+        return results
+
+    try:
+        batch = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        predictions = model.predict(batch)
+        proba_raw = model.predict_proba(batch) if hasattr(model, "predict_proba") else None
+    except Exception as e:
+        # Don't let one bad row fail the whole batch: fall back to per-input calls
+        logger.warning(f"Batched prediction failed ({e}); retrying inputs individually.")
+        for i in positions:
+            results[i] = predict_with_model(model, model_info, inputs[i])
+        return results
+
+    for row, i in enumerate(positions):
+        results[i] = _format_prediction(predictions[row], proba_raw[row] if proba_raw is not None else None)
+    logger.info(f"Batched prediction successful for {len(positions)} of {len(inputs)} inputs.")
+    return results 
\ No newline at end of file
@@ -0,0 +1,32 @@
+import redis
+import redis.asyncio
+from .. import config
+import logging
+
+logger = logging.getLogger(__name__)
+
+if not config.REDIS_URL:
+    # Fall back to in-process stores; only safe with a single worker
+    logger.info("REDIS_URL not configured. Using in-memory stores for nonces and jobs (single worker only).")
+    redis_client = None
+    async_redis_client = None
+else:
+    # The client holds a thread-safe connection pool shared by all requests.
+    # Callers are sync endpoints running in the threadpool, so bound every call:
+    # a stalled Redis fails the request instead of pinning a worker thread.
+    redis_client = redis.Redis.from_url(
+        config.REDIS_URL,
+        decode_responses=True,
+        socket_connect_timeout=2,
+        socket_timeout=2,
+        health_check_interval=30,
+    )
+    # Async client for lookups made directly from async endpoints (e.g. the
+    # prediction cache), which must not block the event loop. Values are bytes.
+    async_redis_client = redis.asyncio.Redis.from_url(
+        config.REDIS_URL,
+        socket_connect_timeout=2,
+        socket_timeout=2,
+        health_check_interval=30,
+    )
+    logger.info("Redis client initialized for shared nonce and job stores.")
@@ -0,0 +1,207 @@
+# backend/services/training_pipeline.py
+
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict
+
+import orjson
+
+from . import dataset_cache, fvm_service, lighthouse_service, ml_service
+from .. import config, job_store, scratch
+
+logger = logging.getLogger(__name__)
+
+# --- Training Job Pipeline ---
+# The work of one training job, shared by the API server's background tasks
+# (routers/training.py) and Celery workers (celery_app.py). Progress and results
+# are reported through job_store.
+
+# Model fitting holds the GIL, which stalls the event loop and every request
+# handler in this process while a model trains. With TRAINING_WORKERS set it runs
+# in worker processes instead, and the job's thread just waits for the result.
+# Spawned rather than forked: the server already runs threads.
+_train_pool: ProcessPoolExecutor | None = (
+    ProcessPoolExecutor(
+        max_workers=min(config.TRAINING_WORKERS, os.cpu_count() or 1),
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+    if config.TRAINING_WORKERS > 0
+    else None
+)
+
+def shutdown_train_pool():
+    """Stops the training worker processes, if any."""
+    if _train_pool is not None:
+        _train_pool.shutdown(wait=False, cancel_futures=True)
+
+def run_training_job(
+    job_id: str, 
+    dataset_cid: str,
+    owner_address: str,
+    model_type: str,
+    target_column: str,
+    hyperparameters: Dict[str, Any],
+    payment_tx_hash: str,
+    payment_nonce: str
+):
+    """
+    Runs a training job: verifies payment, downloads the dataset, then trains the
+    model and leaves it in the job's directory for upload. Blocking; callers run it in
+    a worker thread (or a Celery worker).
+    """
+    logger.info("Background job %s started. Verifying payment %s...", job_id, payment_tx_hash)
+    # --- Optional: Update status to indicate verification step --- 
+    job_store.update_job_status(job_id, "VERIFYING_PAYMENT", "Verifying service fee payment...")
+    
+    temp_dir = None # Holds the trained model/info, and the dataset unless it's cached
+    job_dataset_path = None # Dataset downloaded into temp_dir, deleted once the job ends
+    cached_dataset_path = None # Dataset from dataset_cache, released once the job ends
+    temp_model_path = None # Will hold the path to the saved model in temp_dir
+    temp_info_path = None # Will hold the path to the saved info in temp_dir
+    accuracy = None
+    payment_claimed = False # Released again unless the job completes
+    completed = False
+
+    try:
+        # Reject a payment that already paid for another job before any RPC or download
+        claimed = fvm_service.claim_payment(payment_tx_hash, job_id)
+        if claimed is None:
+            job_store.update_job_status(job_id, "FAILED", "Payment claim unavailable: the payment could not be checked for reuse. Please try again later.")
+            return
+        if not claimed:
+            logger.warning("Job %s: Payment tx %s was already used by another job", job_id, payment_tx_hash)
+            job_store.update_job_status(job_id, "FAILED", "This service fee payment has already been used.")
+            return
+        payment_claimed = True
+
+        # --- 1. Payment Verification --- 
+        payment_verified = fvm_service.verify_payment(
+            tx_hash=payment_tx_hash,
+            expected_payer=owner_address, # Use owner_address passed to task
+            expected_amount=config.TRAINING_SERVICE_FEE, # Checked by start_training before accepting the job
+            expected_service_type="TRAINING",
+            expected_nonce=payment_nonce
+        )
+
+        if not payment_verified:
+            logger.warning("Job %s: Payment verification failed for tx %s", job_id, payment_tx_hash)
+            job_store.update_job_status(job_id, "FAILED", "Service fee payment verification failed.")
+            return
+        
+        logger.info("Job %s: Payment verified successfully.", job_id)
+        # --- End Payment Verification --- 
+
+        # Create the job's working directory. The model and info files in it
+        # outlive this task until they're uploaded (or reaped).
+        temp_dir = scratch.job_dir(job_id)
+        logger.info("Created working directory for training job %s: %s", job_id, temp_dir)
+
+        # 2. Fetch the dataset (or take it from the cache). Only once the payment is
+        # verified: an unpaid request must not make the server download, or fill the
+        # shared dataset cache with, whatever CID it names.
+        job_store.update_job_status(job_id, "DOWNLOADING")
+        if config.DATASET_CACHE_DIR:
+            dataset_path = cached_dataset_path = dataset_cache.get_or_fetch(dataset_cid)
+        else:
+            job_dataset_path = os.path.join(temp_dir, f"{dataset_cid}_dataset.csv")
+            dataset_path = job_dataset_path if lighthouse_service.download_file(dataset_cid, job_dataset_path) else None
+        if not dataset_path:
+            logger.error("Job %s: Failed to download dataset %s", job_id, dataset_cid)
+            job_store.update_job_status(job_id, "FAILED", "Failed to download dataset from storage.")
+            return
+
+        # 3. Train model, saving outputs into the same job temp directory
+        job_store.update_job_status(job_id, "TRAINING")
+        train_args = dict(
+            dataset_path=dataset_path,
+            output_dir=temp_dir, # Pass the temp dir for saving model/info
+            model_type=model_type,
+            target_column=target_column,
+            hyperparameters=hyperparameters
+        )
+        if _train_pool is not None:
+            result = _train_pool.submit(ml_service.train_model_on_dataset, **train_args).result()
+        else:
+            result = ml_service.train_model_on_dataset(**train_args)
+        model, model_info, saved_model_path, saved_info_path = result
+        if not model or not model_info or not saved_model_path or not saved_info_path:
+            logger.error("Job %s: Model training failed for dataset %s", job_id, dataset_cid)
+            job_store.update_job_status(job_id, "FAILED", "Model training process failed.")
+            return
+        
+        # Store the paths to the generated files for later upload
+        temp_model_path = saved_model_path
+        temp_info_path = saved_info_path
+        
+        # Store parameters used in metadata
+        accuracy = model_info.get('accuracy')
+        model_info['source_dataset_cid'] = dataset_cid
+        model_info['owner_address'] = owner_address
+        model_info['model_type'] = model_type
+        model_info['target_column'] = target_column
+        model_info['hyperparameters_used'] = hyperparameters
+
+        # Optionally ship the model as ONNX, which loads and predicts faster than a
+        # joblib pickle. Falls back to joblib for models that can't be converted.
+        if config.MODEL_EXPORT_FORMAT == "onnx":
+            onnx_path = os.path.join(temp_dir, "trained_model.onnx")
+            if ml_service.export_onnx(model, len(model_info['features']), onnx_path):
+                os.remove(temp_model_path)
+                temp_model_path = onnx_path
+                model_info['format'] = "onnx"
+        
+        # Rewrite the info file within the job directory. Written next to it and renamed
+        # over it, so a crash mid-write can't leave truncated JSON for the upload to ship.
+        info_tmp_path = f"{temp_info_path}.tmp"
+        with open(info_tmp_path, 'wb') as f:
+            f.write(orjson.dumps(model_info, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
+        os.replace(info_tmp_path, temp_info_path)
+
+        # 4. Mark Training as Complete (Upload & Registration done separately)
+        job_store.update_job_status(
+            job_id, 
+            "TRAINING_COMPLETE",
+            message="Model training finished. Ready for upload and registration.",
+            accuracy=accuracy, 
+            temp_model_path=temp_model_path, # Store the path for the next step
+            temp_info_path=temp_info_path    # Store the path for the next step
+        )
+        completed = True
+        logger.info("Training job %s reached TRAINING_COMPLETE status.", job_id)
+
+    except Exception as e:
+        logger.error("An unexpected error occurred in background training job %s: %s", job_id, e, exc_info=True)
+
+        # Ensure status is FAILED if an exception occurs
+        job_store.update_job_status(job_id, "FAILED", message=f"An unexpected error occurred during training: {e}")
+
+        # If an error occurred *after* model files were saved, we might still have the paths
+        # But the job failed, so maybe clear them or leave them for debugging?
+        # For now, let's leave them if they exist, but the status is FAILED.
+
+    finally:
+        # A failed job doesn't use up its payment, so the user can retry with it
+        if payment_claimed and not completed:
+            fvm_service.release_payment(payment_tx_hash, job_id)
+
+        # Training has read the cached dataset; the sweeper may evict it again
+        if cached_dataset_path:
+            dataset_cache.release(cached_dataset_path)
+
+        # --- Selective Cleanup --- 
+        # Only clean up the downloaded dataset file (cached datasets stay in the cache).
+        # Leave the generated model and info files for the upload step.
+        # The upload endpoint will be responsible for cleaning up those files.
+        if job_dataset_path:
+            # No exists() check first: a missing file (e.g. the download failed) is just ENOENT
+            try: 
+                os.remove(job_dataset_path)
+                logger.info("Job %s: Cleaned up downloaded dataset file: %s", job_id, job_dataset_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e: 
+                logger.error("Job %s: Error cleaning up downloaded dataset file %s: %s", job_id, job_dataset_path, e)
+        # The job directory itself stays with the model/info files. The upload removes
+        # it; scratch.reap_job_dirs deletes it if that never happens.
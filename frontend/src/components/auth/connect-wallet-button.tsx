@@ -63,28 +63,13 @@ export function ConnectWalletButton() {
       })
 
       // 3. Sign message
-      const signature = await signMessageAsync({ message: message.prepareMessage() })
+      const preparedMessage = message.prepareMessage()
+      const signature = await signMessageAsync({ message: preparedMessage })
 
       // 4. Verify signature with backend
-      // Construct a plain object with snake_case keys matching backend expectations
-      const messageToSend = {
-        domain: message.domain,
-        address: message.address,
-        statement: message.statement,
-        uri: message.uri,
-        version: message.version,
-        chain_id: message.chainId, // Map to snake_case
-        nonce: message.nonce,
-        issued_at: message.issuedAt, // Map to snake_case
-        // Include other optional fields if needed by backend validation
-        // expiration_time: message.expirationTime,
-        // not_before: message.notBefore,
-        // request_id: message.requestId,
-        // resources: message.resources // If you use resources
-      };
-
+      // Send the exact EIP-4361 string that was signed; the backend parses it directly
       const verifyRes = await axios.post(`${backendUrl}/auth/verify`, {
-        message: messageToSend, // Send the constructed plain object
+        message: preparedMessage,
         signature,
       })
 
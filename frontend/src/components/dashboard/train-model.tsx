@@ -93,6 +93,26 @@ export function TrainModel() {
     query: { enabled: !!writeContractHash }
   });
 
+  // Records a job status update and stops watching once the job is settled
+  const applyJobStatus = (currentJobId: string, data: TrainingStatus) => {
+      setJobStatus(data);
+      if (data.status === 'TRAINING_COMPLETE' || data.status === 'COMPLETED' || data.status === 'FAILED' || data.status === 'UPLOAD_FAILED') {
+        setIsPolling(false);
+        if (pollIntervalRef.current) clearInterval(pollIntervalRef.current);
+        if (data.status === 'TRAINING_COMPLETE') {
+             toast.success(`Training job ${currentJobId} complete. Ready for upload.`);
+        } else if (data.status === 'COMPLETED') {
+             toast.success(data.message || `Training job ${currentJobId} completed successfully.`)
+        } else if (data.status === 'UPLOAD_FAILED') {
+             toast.error(`Upload failed: ${data.message || 'Unknown error'}`)
+             setUploadError(data.message || 'Upload failed with unknown error');
+        } else {
+             toast.error(`Training job ${currentJobId} failed: ${data.message || 'Unknown error'}`)
+             setStatusError(data.message || 'Training job failed with unknown error');
+        }
+      }
+  };
+
   // Function to fetch job status
   const fetchJobStatus = async (currentJobId: string) => {
     const token = getAuthToken();
@@ -103,19 +123,7 @@ export function TrainModel() {
       const response = await axios.get(`${backendUrl}/training/status/${currentJobId}`, {
         headers: { 'Authorization': `Bearer ${token}` },
       });
-      setJobStatus(response.data);
-      if (response.data.status === 'TRAINING_COMPLETE' || response.data.status === 'COMPLETED' || response.data.status === 'FAILED') {
-        setIsPolling(false);
-        if (pollIntervalRef.current) clearInterval(pollIntervalRef.current);
-        if (response.data.status === 'TRAINING_COMPLETE') {
-             toast.success(`Training job ${currentJobId} complete. Ready for upload.`);
-        } else if (response.data.status === 'COMPLETED') {
-             toast.success(`Training job ${currentJobId} completed successfully (already uploaded).`)
-        } else {
-             toast.error(`Training job ${currentJobId} failed: ${response.data.message || 'Unknown error'}`)
-             setStatusError(response.data.message || 'Training job failed with unknown error');
-        }
-      }
+      applyJobStatus(currentJobId, response.data);
     } catch (error: unknown) {
       console.error(`Error fetching status for job ${currentJobId}:`, error);
       setIsPolling(false);
@@ -144,15 +152,35 @@ export function TrainModel() {
   };
 
   useEffect(() => {
-    if (jobId && isPolling) {
+    if (!jobId || !isPolling) {
+      if (pollIntervalRef.current) clearInterval(pollIntervalRef.current);
+      return;
+    }
+    // Status updates are pushed over a WebSocket; polling is the fallback if it fails
+    let pollingStarted = false;
+    const startPolling = () => {
+        if (pollingStarted) return;
+        pollingStarted = true;
         fetchJobStatus(jobId);
         pollIntervalRef.current = setInterval(() => {
             fetchJobStatus(jobId);
         }, 5000);
+    };
+    const token = getAuthToken();
+    let socket: WebSocket | null = null;
+    if (token && typeof WebSocket !== 'undefined') {
+        socket = new WebSocket(`${backendUrl.replace(/^http/, 'ws')}/training/ws/status/${jobId}?token=${encodeURIComponent(token)}`);
+        socket.onmessage = (event) => applyJobStatus(jobId, JSON.parse(event.data));
+        // 1000 = the server closed it because the job is settled; anything else, fall back
+        socket.onclose = (event) => { if (event.code !== 1000) startPolling(); };
     } else {
-      if (pollIntervalRef.current) clearInterval(pollIntervalRef.current);
+        startPolling();
     }
     return () => {
+      if (socket) {
+        socket.onclose = null;
+        socket.close();
+      }
       if (pollIntervalRef.current) clearInterval(pollIntervalRef.current);
     };
     // eslint-disable-next-line react-hooks/exhaustive-deps
@@ -459,11 +487,10 @@ export function TrainModel() {
              { headers: { 'Authorization': `Bearer ${token}` } }
           );
 
-          // Update job status based on the *final* status from the upload endpoint response
-          // We fetch the full status again to ensure consistency
-          fetchJobStatus(jobId);
-
-          toast.success(response.data.message || "Model uploaded and registered successfully!");
+          // The upload runs in the background (202 Accepted); poll the job status
+          // until it reaches COMPLETED or UPLOAD_FAILED
+          toast.info(response.data.message || "Model upload started.");
+          setIsPolling(true);
 
       } catch (error: unknown) {
           console.error("Upload error:", error);
@@ -739,9 +766,11 @@ export function TrainModel() {
             ) : (
                 // Show specific status during polling/background processing
                 isPolling ? (
+                    jobStatus?.status === 'QUEUED' ? <><Loader2 className="mr-2 h-4 w-4 animate-spin" /> Queued...</> :
                     jobStatus?.status === 'VERIFYING_PAYMENT' ? <><Loader2 className="mr-2 h-4 w-4 animate-spin" /> Verifying Payment...</> :
                     jobStatus?.status === 'DOWNLOADING' ? <><Loader2 className="mr-2 h-4 w-4 animate-spin" /> Downloading Data...</> :
                     jobStatus?.status === 'TRAINING' ? <><Loader2 className="mr-2 h-4 w-4 animate-spin" /> Training Model...</> :
+                    jobStatus?.status === 'UPLOADING_MODEL' ? <><Loader2 className="mr-2 h-4 w-4 animate-spin" /> Uploading Model...</> :
                     'Processing...' // Fallback while polling
                 ) : 
                 jobStatus?.status === 'TRAINING_COMPLETE' ? 'Training Complete' : // Indicate completion if button is visible but disabled